@@ -0,0 +1,32 @@
+"""
+  Times grammar loading through Bnf
+
+  Run with
+
+      python3 benchmarks/load_defs.py
+"""
+
+import os
+import sys
+import timeit
+sys.path.append(os.path.join(sys.path[0], '..'))
+from lib import Bnf, Lib
+
+
+def long_rule(n):
+  return ' | '.join(f'"{i}" ns-char* [x20-x7E]' for i in range(n))
+
+
+def best_of(stmt, number=5, repeat=5):
+  return min(timeit.repeat(stmt, number=number, repeat=repeat)) / number
+
+
+def main():
+  print(f"load_defs: {best_of(lambda: Lib(cache=False)) * 1000:8.2f} ms")
+  for n in (100, 1000, 10000):
+    text = long_rule(n)
+    print(f"Bnf {len(text):7} chars: {best_of(lambda: Bnf(text), number=1, repeat=3) * 1000:8.2f} ms")
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,217 @@
+"""
+  Times Lib construction, grammar loading, the yaml-test-suite spec examples and synthetic documents,
+  writes the timings as JSON and compares them against a stored baseline
+
+  Run with
+
+      python3 benchmarks/suite.py
+      python3 benchmarks/suite.py --sizes 1K,10K,100K,1M,10M --output bench.json
+      python3 benchmarks/suite.py --update-baseline
+      python3 benchmarks/suite.py --memo-size 100000 --output memo.json
+
+  Exits with status 1 if any benchmark is more than --tolerance slower than the baseline, or stopped parsing,
+  and with status 2 if there is no baseline to compare against.
+  Timings only compare on the same machine, so the baseline isn't checked in; make one with --update-baseline.
+"""
+
+import argparse
+import glob
+import json
+import os
+import platform
+import sys
+import time
+sys.path.append(os.path.join(sys.path[0], '..'))
+from lib import Bnf, Lib, split_defs
+from load_defs import best_of
+
+root = os.path.join(sys.path[0], '..')
+
+STREAM = ('rule', 'l-yaml-stream')
+
+# Differences below this many seconds are timer noise, whatever the ratio
+NOISE = 0.001
+
+SIZES = {'1K': 1 << 10, '10K': 10 << 10, '100K': 100 << 10, '1M': 1 << 20, '10M': 10 << 20}
+
+
+def repeat_to(size, chunk):
+  """chunk(i) for i = 0, 1, ... joined until at least size chars"""
+  parts, n, i = [], 0, 0
+  while n < size:
+    parts.append(chunk(i))
+    n += len(parts[-1])
+    i += 1
+  return ''.join(parts)
+
+# The tuple engine recurses per nesting level and runs out of stack from about 24
+def deep_nesting(size, depth=16):
+  def chunk(i):
+    return ''.join(f"{'  ' * d}- k{i}:\n" for d in range(depth)) + f"{'  ' * depth}- leaf{i}\n"
+  return repeat_to(size, chunk)
+
+def long_sequence(size):
+  return repeat_to(size, lambda i: f'- item {i}\n')
+
+def long_plain(size):
+  return 'key: ' + repeat_to(size, lambda i: f'word{i} ') + 'end\n'
+
+def long_quoted(size):
+  return 'key: "' + repeat_to(size, lambda i: f'quoted {i}, ') + 'end"\n'
+
+# Each flow collection is also tried as an implicit key and as each kind of flow node, so without memo_size every
+# nesting level multiplies the backtracking
+def nested_flow(size, depth=4):
+  return repeat_to(size, lambda i: f"- {'[' * depth}a{i}{']' * depth}\n")
+
+SYNTHETIC = {
+  'deep-nesting': deep_nesting,
+  'long-sequence': long_sequence,
+  'long-plain': long_plain,
+  'long-quoted': long_quoted,
+  'nested-flow': nested_flow,
+}
+
+
+# yaml-test-suite shows whitespace with visible characters in .tml files
+TML_MARKS = [('␣', ' '), ('————»', '\t'), ('———»', '\t'), ('——»', '\t'), ('—»', '\t'), ('»', '\t'),
+             ('↵', ''), ('←', '\r'), ('⇔', '﻿')]
+
+def tml_yaml(path):
+  parts, curr = {}, 'head'
+  with open(path, encoding='utf-8') as f:
+    for line in f:
+      if line.startswith('--- '):
+        curr = line[4:].strip()
+      else:
+        parts.setdefault(curr, []).append(line)
+  text = ''.join(parts.get('in-yaml', []))
+  for mark, c in TML_MARKS:
+    text = text.replace(mark, c)
+  if text.endswith('∎\n'):
+    text = text[:-2]
+  return text
+
+def spec_examples():
+  paths = sorted(glob.glob(os.path.join(root, 'yaml-test-suite', 'test', 'name', 'spec-example-*.tml')))
+  for path in paths:
+    name = os.path.basename(path).replace('spec-example-', '').replace('.tml', '')
+    yield name, tml_yaml(path)
+
+
+def time_parse(library, text, repeat):
+  """(best seconds, whether text parsed, the name of the exception if not)"""
+  best, error = None, None
+  for _ in range(repeat):
+    start = time.perf_counter()
+    try:
+      library.parse(text, STREAM)
+    except Exception as e:
+      error = type(e).__name__
+    elapsed = time.perf_counter() - start
+    best = elapsed if best is None else min(best, elapsed)
+  return best, error is None, error
+
+def load_bnf():
+  with open(os.path.join(root, 'productions.bnf'), encoding='utf-8') as f:
+    text = f.read()
+  for name, rule in split_defs(text):
+    Bnf(name)
+    Bnf(rule)
+
+
+def run(args):
+  results = {}
+  def record(name, seconds, ok=True, error=None):
+    results[name] = dict(seconds=seconds, ok=ok, error=error)
+    print(f"{name:40} {seconds * 1000:10.2f} ms{'' if ok else f'  (no parse: {error})'}", flush=True)
+
+  options = dict(engine=args.engine, memo_size=args.memo_size)
+  record('lib/construct', best_of(lambda: Lib(**options)))
+  record('lib/construct-uncached', best_of(lambda: Lib(cache=False, **options), number=1, repeat=3))
+  record('bnf/productions', best_of(load_bnf, number=1, repeat=3))
+
+  library = Lib(**options)
+  if not args.no_spec:
+    examples = list(spec_examples())
+    if not examples:
+      print('yaml-test-suite not checked out, skipping spec examples', file=sys.stderr)
+    for name, text in examples:
+      record(f'spec/{name}', *time_parse(library, text, args.repeat))
+
+  for size_name in args.sizes.split(','):
+    size = SIZES[size_name]
+    for kind, generate in SYNTHETIC.items():
+      # One run is already long enough to time reliably
+      repeat = args.repeat if size <= SIZES['10K'] else 1
+      record(f'synthetic/{kind}/{size_name}', *time_parse(library, generate(size), repeat))
+
+  return dict(
+    python=platform.python_version(),
+    machine=platform.machine(),
+    engine=args.engine,
+    memo_size=args.memo_size,
+    grammar_version=library.grammar_version,
+    results=results,
+  )
+
+def compare(current, baseline, tolerance):
+  """Messages for each benchmark that got slower than baseline by more than tolerance, or stopped parsing"""
+  regressions = []
+  for name, result in current['results'].items():
+    if not (base := baseline['results'].get(name)):
+      continue
+    if base['ok'] and not result['ok']:
+      regressions.append(f"{name}: no longer parses ({result['error']})")
+    elif result['seconds'] - base['seconds'] > NOISE and result['seconds'] > base['seconds'] * (1 + tolerance):
+      regressions.append(f"{name}: {base['seconds'] * 1000:.2f} ms -> {result['seconds'] * 1000:.2f} ms "
+                         f"({result['seconds'] / base['seconds']:.2f}x)")
+  return regressions
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument('--sizes', default='1K,10K', help=f"comma separated synthetic document sizes from {','.join(SIZES)}")
+  parser.add_argument('--engine', default='tuple', choices=Lib.engines)
+  parser.add_argument('--memo-size', type=int, help="Lib(memo_size=...), only for --engine tuple")
+  parser.add_argument('--repeat', type=int, default=3, help='runs per small document, keeping the fastest')
+  parser.add_argument('--no-spec', action='store_true', help='skip the yaml-test-suite spec examples')
+  parser.add_argument('--output', help='write results JSON here')
+  parser.add_argument('--baseline', default=os.path.join(sys.path[0], 'baseline.json'))
+  parser.add_argument('--update-baseline', action='store_true', help='write results to --baseline instead of comparing')
+  parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown, as a fraction of the baseline')
+  args = parser.parse_args(argv)
+  for size_name in args.sizes.split(','):
+    if size_name not in SIZES:
+      parser.error(f'unknown size {size_name}')
+
+  current = run(args)
+
+  if args.output:
+    with open(args.output, 'w') as f:
+      json.dump(current, f, indent=2)
+  if args.update_baseline:
+    with open(args.baseline, 'w') as f:
+      json.dump(current, f, indent=2)
+    print('wrote baseline', args.baseline)
+    return 0
+
+  try:
+    with open(args.baseline) as f:
+      baseline = json.load(f)
+  except FileNotFoundError:
+    # Otherwise a CI run without a baseline would pass without having compared anything
+    print('no baseline at', args.baseline, '- create one with --update-baseline', file=sys.stderr)
+    return 2
+
+  if regressions := compare(current, baseline, args.tolerance):
+    print(f'\n{len(regressions)} regressions against {args.baseline}:', file=sys.stderr)
+    for r in regressions:
+      print('  ' + r, file=sys.stderr)
+    return 1
+  print('no regressions against', args.baseline)
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -1,12 +1,23 @@
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
 from dataclasses import dataclass
 from pathlib import Path
 from typing import Iterator
+import hashlib
+import itertools
 import math
+import multiprocessing
+import os
+import pickle
 import re
 import sys
+import tempfile
+import time
 
 
-M_VAR_MAX = 6
+# Bump whenever Bnf output or the Lib.bnf layout changes, so stale grammar caches are ignored
+LIB_VERSION = 2
 
 def solo(items, default=None):
   if len(items) == 1:
@@ -98,7 +109,7 @@ class Bnf:
     return e
 
   # Rule names can contain '+' so if followed by a letter it's part of the name not a regex repeat.
-  ident_reg = r'^((?:[\w-]|\+\w)+)(\([\w(),<≤/\+-]+\))?'
+  ident_reg = r'((?:[\w-]|\+\w)+)(\([\w(),<≤/\+-]+\))?'
 
   def parseSingle(self):
     if self.try_take('"'):
@@ -161,13 +172,18 @@ class Bnf:
       cs.append(self.take())
     return ''.join(cs)
 
+  # Compiled once per pattern string, and matched in place with pattern.match(text, pos) instead of slicing
+  patterns = {}
+  whitespace = re.compile(r'\s*')
+
   def try_take(self, pattern='.') -> str:
-    m = re.match(pattern, self.text[self.i:])
+    if not (compiled := Bnf.patterns.get(pattern)):
+      compiled = Bnf.patterns[pattern] = re.compile(pattern)
+    m = compiled.match(self.text, self.i)
     if not m:
       return None
     s = m.group()
-    self.i += len(s)
-    self.try_take(r'\s+')
+    self.i = Bnf.whitespace.match(self.text, m.end()).end()
     return s
 
   def take(self, pattern='.'):
@@ -182,6 +198,8 @@ def str_concat(head, tail):
     return head + tail
   if tail is None:
     return head
+  if isinstance(head, Lazy) or isinstance(tail, Lazy):
+    return LazyConcat(head, tail)
   try:
     comb = (head, *tail)
   except:
@@ -198,6 +216,65 @@ def split_defs(bnf_text):
     name, text = (s.strip() for s in def_str.split('::='))
     yield name, text
 
+line_reg = re.compile(r'[^\r\n]*(?:\r\n?|\n)')
+
+def source_lines(source) -> Iterator[str]:
+  """Lines (keeping their line breaks) of YAML text as a str, a path as an os.PathLike, a text file object, or an
+  iterable of str chunks"""
+  if isinstance(source, str):
+    source = source,
+  elif isinstance(source, os.PathLike):
+    with open(source, 'r', encoding='utf-8', newline='') as f:
+      yield from f
+    return
+  if hasattr(source, 'readline'):
+    yield from iter(source.readline, '')
+    return
+
+  # YAML line breaks are only CR, LF and CRLF; a CR at the end of a chunk may be the start of a CRLF
+  pending = ''
+  for chunk in source:
+    held_cr = pending.endswith('\r')
+    pending += chunk
+    if not held_cr and '\n' not in chunk and '\r' not in chunk:
+      continue
+    end = 0
+    for m in line_reg.finditer(pending):
+      if m.end() == len(pending) and pending[-1] == '\r':
+        break
+      yield m.group()
+      end = m.end()
+    pending = pending[end:]
+  if pending:
+    yield pending
+
+def is_marker(line, marker):
+  return line.startswith(marker) and (len(line) == 3 or line[3] in ' \t\r\n')
+
+def split_documents(lines) -> Iterator[str]:
+  """Split a YAML stream into texts that are each a valid l-yaml-stream holding one document.
+
+  Spec 9.2: a line starting with "---" or "..." can't be document content, so a "---" after content starts the
+  next document and "..." ends the current one. A line starting with "%" is only a directive once the document
+  is ended, as inside a block scalar it's content. Comments, directives and blank lines before a document stay
+  with it as its l-document-prefix."""
+  doc, started = [], False
+  for line in lines:
+    if started and is_marker(line, '---'):
+      yield ''.join(doc)
+      doc, started = [], False
+
+    doc.append(line)
+    if is_marker(line, '...'):
+      if started:
+        yield ''.join(doc)
+        doc, started = [], False
+    elif is_marker(line, '---') or (line.strip() and not line.lstrip().startswith(('#', '%'))):
+      started = True
+
+  if started:
+    yield ''.join(doc)
+
 @dataclass(frozen=True)
 class ParseResult:
   name: str
@@ -205,8 +282,21 @@ class ParseResult:
   end: int
   expr: object
 
+  def __post_init__(self):
+    # Hashed once as the tree is built bottom up, so hashing a deep tree neither recurses nor revisits children
+    object.__setattr__(self, '_hash', hash((self.name, self.start, self.end, self.expr)))
+
+  def __hash__(self):
+    return self._hash
+
+  def __reduce__(self):
+    # str hashes differ between processes, so _hash is recomputed rather than pickled
+    return ParseResult, (self.name, self.start, self.end, self.expr)
+
 def find_vars(expr):
   match expr:
+    case range():
+      return set()
     case ('rule', _, *args):
       return set(a for arg in args for a in arg.split('+') if a.isalpha() and a.islower() and len(a) == 1)
     case (_, *es):
@@ -216,87 +306,1103 @@ def find_vars(expr):
     case _:
       return set() 
 
-def define_unbound(vars):
-  if not vars:
-    yield {}
-    return
+class First:
+  """Characters that can start a match of an expression, and whether it can match without consuming any"""
+  __slots__ = 'chars', 'ranges', 'nullable', 'ascii'
+
+  def __init__(self, chars=frozenset(), ranges=frozenset(), nullable=False):
+    self.chars = frozenset(chars)
+    self.ranges = frozenset(ranges)
+    self.nullable = nullable
+    # Bitmask of code points below 128, which is nearly every character in practice
+    self.ascii = 0
+    for c in self.chars:
+      if ord(c) < 128:
+        self.ascii |= 1 << ord(c)
+    for r in self.ranges:
+      if r.start < 128:
+        self.ascii |= (1 << min(r.stop, 128)) - (1 << r.start)
 
-  var, *vars = vars
-  match var:
-    case 'm':
-      for f in define_unbound(vars):
-        for m in range(0, M_VAR_MAX):
-          yield f | {'m': m}
-    case 't':
-      for f in define_unbound(vars):
-        for t in 'CLIP KEEP STRIP'.split():
-          yield f | {'t': t}
+  def __or__(self, other):
+    return First(self.chars | other.chars, self.ranges | other.ranges, self.nullable or other.nullable)
+
+  def __eq__(self, other):
+    return (self.chars, self.ranges, self.nullable) == (other.chars, other.ranges, other.nullable)
+
+  def __repr__(self):
+    return f'First({set(self.chars)}, {set(self.ranges)}, nullable={self.nullable})'
+
+  def allows(self, text, i):
+    if self.nullable:
+      return True
+    if i >= len(text):
+      return False
+    o = ord(text[i])
+    if o < 128:
+      return self.ascii >> o & 1
+    return text[i] in self.chars or any(o in r for r in self.ranges)
+
+First.EMPTY = First(nullable=True)
+
+def first_set(expr, rule_firsts: dict[str, First]) -> First:
+  """Conservative FIRST set: parameters are ignored, so a rule starts with anything any of its definitions can"""
+  match expr:
+    case str(s):
+      return First({s[0]}) if s else First.EMPTY
+    case range():
+      return First(ranges={expr})
+    case set() | frozenset():
+      first = First()
+      for e in expr:
+        first |= first_set(e, rule_firsts)
+      return first
+    case ('concat', *es):
+      first = First()
+      for e in es:
+        f = first_set(e, rule_firsts)
+        first = First(first.chars | f.chars, first.ranges | f.ranges)
+        if not f.nullable:
+          return first
+      return first | First.EMPTY
+    case ('repeat', lo, hi, e):
+      first = first_set(e, rule_firsts)
+      return first | First.EMPTY if lo == 0 else first
+    case ('diff', e, *_):
+      return first_set(e, rule_firsts)
+    case ('rule', name, *_):
+      return rule_firsts.get(name, First())
     case _:
-      raise ValueError(var)
+      # ^ $ and lookarounds are zero-width
+      return First.EMPTY
+
+def char_intervals(expr) -> list[tuple[int, int]]:
+  """Sorted disjoint [lo, hi) code point intervals of a single-character expr, or None"""
+  match expr:
+    case str(s) if len(s) == 1:
+      return [(ord(s), ord(s) + 1)]
+    case range():
+      return [(expr.start, expr.stop)]
+  return None
+
+def union_intervals(a, b):
+  merged = []
+  for lo, hi in sorted(a + b):
+    if merged and lo <= merged[-1][1]:
+      merged[-1] = merged[-1][0], max(hi, merged[-1][1])
+    else:
+      merged.append((lo, hi))
+  return merged
+
+def subtract_intervals(a, b):
+  result = []
+  for lo, hi in a:
+    for blo, bhi in b:
+      if bhi <= lo or hi <= blo:
+        continue
+      if lo < blo:
+        result.append((lo, blo))
+      lo = max(lo, bhi)
+      if lo >= hi:
+        break
+    if lo < hi:
+      result.append((lo, hi))
+  return result
+
+def class_pattern(intervals):
+  def esc(o):
+    return f'\\U{o:08x}'
+  return '[' + ''.join(esc(lo) if hi == lo + 1 else f'{esc(lo)}-{esc(hi - 1)}' for lo, hi in intervals) + ']'
+
+def lazy_match(pattern):
+  """pattern.match, but only compiled on first use; large Unicode classes are slow to compile"""
+  compiled = None
+  def match(text, i):
+    nonlocal compiled
+    if compiled is None:
+      compiled = re.compile(pattern)
+    return compiled.match(text, i)
+  return match
+
+def intervals_first(intervals) -> First:
+  return First(ranges={range(lo, hi) for lo, hi in intervals})
+
+class Terminal:
+  """Native matcher for a subtree made only of terminals, whose value is always text[i:end] (None if empty).
+
+  ends(text, i) lists every end position the subtree can match to. Single characters keep their code point
+  intervals in chars, and subtrees with exactly one possible match length keep a regex source in pattern."""
+  __slots__ = 'ends', 'nullable', 'pattern', 'chars'
+
+  def __init__(self, ends, *, nullable=False, pattern=None, chars=None):
+    self.ends = ends
+    self.nullable = nullable
+    self.pattern = pattern
+    self.chars = chars
+
+  @staticmethod
+  def of_pattern(pattern, chars=None):
+    match = lazy_match(pattern)
+    def ends(text, i):
+      m = match(text, i)
+      return (m.end(),) if m else ()
+    return Terminal(ends, pattern=pattern, chars=chars)
+
+  @staticmethod
+  def of_chars(chars):
+    return Terminal.of_pattern(class_pattern(chars), chars)
+
+def compile_terminal(expr, terminal_rule) -> Terminal:
+  """Returns a Terminal if expr only contains strings, ranges, alternations, repeats, diffs and terminal rules.
+
+  Empty matches are only allowed at the top of the subtree or at the end of a concat: resolve() would combine
+  an empty None value with a following value into a tuple, not a str."""
+  if chars := char_intervals(expr):
+    return Terminal.of_chars(chars)
+
+  match expr:
+    case str(s) if s:
+      return Terminal.of_pattern(re.escape(s))
+    case set() | frozenset():
+      options = [compile_terminal(e, terminal_rule) for e in expr]
+      if not all(options):
+        return None
+      if all(o.chars for o in options):
+        chars = []
+        for o in options:
+          chars = union_intervals(chars, o.chars)
+        return Terminal.of_chars(chars)
+      def ends(text, i):
+        return {end for o in options for end in o.ends(text, i)}
+      return Terminal(ends, nullable=any(o.nullable for o in options))
+    case ('concat', e):
+      return compile_terminal(e, terminal_rule)
+    case ('concat', _, *_):
+      items = [compile_terminal(e, terminal_rule) for e in expr[1:]]
+      if not all(items) or any(t.nullable for t in items[:-1]):
+        return None
+      if all(t.pattern for t in items):
+        return Terminal.of_pattern(''.join(f'(?:{t.pattern})' for t in items))
+      def ends(text, i):
+        positions = {i}
+        for t in items:
+          positions = {end for p in positions for end in t.ends(text, p)}
+        return positions
+      return Terminal(ends)
+    case ('repeat', lo, hi, e):
+      t = compile_terminal(e, terminal_rule)
+      if not t or t.nullable:
+        return None
+      if t.pattern and lo == hi:
+        return Terminal.of_pattern(f'(?:{t.pattern}){{{lo}}}')
+      if t.chars:
+        # One greedy run of the class, then every length from lo up to the run is a match
+        run = lazy_match(t.pattern + ('*' if hi == math.inf else f'{{0,{hi}}}'))
+        def ends(text, i):
+          n = run(text, i).end() - i
+          return range(i + lo, i + n + 1) if n >= lo else ()
+      else:
+        def ends(text, i):
+          result, positions, count = [], {i}, 0
+          while positions and count <= hi:
+            if count >= lo:
+              result.extend(positions)
+            count += 1
+            positions = {end for p in positions for end in t.ends(text, p)}
+          return result
+      return Terminal(ends, nullable=lo == 0)
+    case ('diff', e, *subtrahends):
+      t = compile_terminal(e, terminal_rule)
+      subs = [compile_terminal(s, terminal_rule) for s in subtrahends]
+      if not t or not all(subs):
+        return None
+      if t.chars and all(s.chars for s in subs):
+        chars = t.chars
+        for sub in subs:
+          chars = subtract_intervals(chars, sub.chars)
+        return Terminal.of_chars(chars) if chars else None
+      def ends(text, i):
+        if any(s.ends(text, i) for s in subs):
+          return ()
+        return t.ends(text, i)
+      return Terminal(ends, nullable=t.nullable)
+    case ('rule', name):
+      return terminal_rule(name)
+  return None
+
+class Terminals(dict):
+  """The Terminal of each parameterless rule made only of terminals, else None, by rule name.
+  Each is compiled on first lookup, as a parse only looks up a few of the rules."""
+
+  def __init__(self, bnf):
+    super().__init__()
+    self.bnf = bnf
+
+  def __missing__(self, name):
+    self[name] = None  # Until proven otherwise, which also stops recursive rules
+    defs = self.bnf[name]
+    if not any(params for params, _ in defs):
+      expr = defs[0][1] if len(defs) == 1 else frozenset(expr for _, expr in defs)
+      self[name] = compile_terminal(expr, self.__getitem__)
+    return self[name]
+
+ENUMS = 'BLOCK-IN BLOCK-KEY BLOCK-OUT CLIP FLOW-IN FLOW-KEY FLOW-OUT KEEP STRIP'.split()
+# Far above any indentation level, so a context never compares equal to a number
+ENUM_IDS = {name: 1 << 16 | i for i, name in enumerate(ENUMS)}
+IN_FLOW = {ENUM_IDS[c]: ENUM_IDS[f] for c, f in [
+  ('FLOW-OUT', 'FLOW-IN'), ('FLOW-IN', 'FLOW-IN'), ('BLOCK-KEY', 'FLOW-KEY'), ('FLOW-KEY', 'FLOW-KEY')]}
+
+# A frame is a tuple holding the value of each of these variables, or None while unbound
+VARS = 'n', 'm', 'c', 't'
+VAR_SLOTS = {var: slot for slot, var in enumerate(VARS)}
+EMPTY_FRAME = (None,) * len(VARS)
+
+def compile_arg(arg):
+  """Function frame -> value of a rule argument: a context, an in-flow(c), or a sum of ints and variables like n+1+m"""
+  if arg in ENUM_IDS:
+    value = ENUM_IDS[arg]
+    return lambda frame: value
+  if m := re.fullmatch(r'in-flow\((\w)\)?', arg):
+    slot = VAR_SLOTS[m[1]]
+    return lambda frame: IN_FLOW[frame[slot]]
+
+  terms = re.findall(r'([+-]?)([a-z]|\d+)', arg)
+  if ''.join(sign + term for sign, term in terms) != arg:
+    raise NotImplementedError(arg)
+  const = sum(int(sign + term) for sign, term in terms if term.isdigit())
+  slots = [(-1 if sign == '-' else 1, VAR_SLOTS[term]) for sign, term in terms if not term.isdigit()]
+  if not slots:
+    return lambda frame: const
+  if len(slots) == 1 and slots[0][0] == 1 and not const:
+    slot = slots[0][1]
+    return lambda frame: frame[slot]
+  def value(frame):
+    if any(frame[slot] is None for _, slot in slots):
+      raise ValueError('unbound variable in', arg)
+    return const + sum(sign * frame[slot] for sign, slot in slots)
+  return value
+
+def compile_param(param):
+  """(None, value) for a param that must equal value, or (slot, k) for var+k that binds slot to arg - k"""
+  if param.isdigit():
+    return None, int(param)
+  if param in ENUM_IDS:
+    return None, ENUM_IDS[param]
+  if m := re.fullmatch(r'([a-z])(?:\+(\d+))?', param):
+    return VAR_SLOTS[m[1]], int(m[2] or 0)
+  raise NotImplementedError(param)
+
+def binding_plan(params, args):
+  """Function from the caller's frame to the frame a definition runs in, or None when a param doesn't match"""
+  plan = [(compile_param(param), compile_arg(arg)) for param, arg in zip(params, args)]
+  def bind(frame):
+    new_frame = list(EMPTY_FRAME)
+    for (slot, k), arg in plan:
+      value = arg(frame)
+      if slot is None:
+        if value != k: return None
+      else:
+        if k and (value is None or value < k): return None
+        new_frame[slot] = value - k if k else value
+    return tuple(new_frame)
+  return bind
+
+SPACES = re.compile(' *')
+
+def count_spaces(text, i):
+  return SPACES.match(text, i).end() - i
+
+def header_indicators(text, i):
+  """(indentation digit or None, chomping indicator or '') of the block scalar header after the '|' or '>' at i"""
+  a, b = text[i + 1:i + 2], text[i + 2:i + 3]
+  if a and a in '+-':
+    return (int(b) if b and b in '123456789' else None), a
+  if a and a in '123456789':
+    return int(a), (b if b and b in '+-' else '')
+  return None, ''
+
+def block_scalar_indent(text, i, frame):
+  """m for the block scalar at i: its indentation indicator, else auto-detected from the first non-empty line"""
+  digit, _ = header_indicators(text, i)
+  if digit is not None:
+    return [digit]
+  n = frame[VAR_SLOTS['n']]
+  longest = 0
+  j = text.find('\n', i)
+  while j != -1:
+    end = j + 1 + count_spaces(text, j + 1)
+    if end < len(text) and text[end] not in '\r\n':
+      return [max(end - j - 1 - n, 1)]
+    longest = max(longest, end - j - 1)
+    j = text.find('\n', end)
+  return [max(longest - n, 1)]
+
+def block_scalar_chomping(text, i, frame):
+  _, chomping = header_indicators(text, i)
+  return [ENUM_IDS[{'-': 'STRIP', '+': 'KEEP'}.get(chomping, 'CLIP')]]
+
+def collection_indent(text, i, frame):
+  """m for a block collection starting on the line at i, indented n+1+m"""
+  m = count_spaces(text, i) - frame[VAR_SLOTS['n']] - 1
+  return [m] if m >= 0 else []
+
+# Variables a definition leaves unbound, inferred from the input where the rule is entered instead of enumerated
+INFERRED = {
+  ('c-l+literal', 'm'): block_scalar_indent,
+  ('c-l+literal', 't'): block_scalar_chomping,
+  ('c-l+folded', 'm'): block_scalar_indent,
+  ('c-l+folded', 't'): block_scalar_chomping,
+  ('l+block-sequence', 'm'): collection_indent,
+  ('l+block-mapping', 'm'): collection_indent,
+  ('s-l+block-indented', 'm'): lambda text, i, frame: [count_spaces(text, i)],
+}
+
+def fold_values(values):
+  """The value resolve() builds for a concat or repeat, from a linked list (value, values, _) newest first.
+
+  Same as calling str_concat(v, result) for each value, but a str or tuple result is kept as a reversed list
+  of pieces while folding, so n values cost O(n) rather than copying the result each time. A Lazy value must
+  already be built, as built() does before folding."""
+  strs = items = None
+  result = None
+  while values:
+    v, values, _ = values
+    if isinstance(v, Lazy):
+      v = v.value
+    if items is not None:
+      items.append(v)
+      continue
+    if strs is not None:
+      if isinstance(v, str):
+        strs.append(v)
+        continue
+      result, strs = ''.join(reversed(strs)), None
 
-def automagically_define_unbound(expr: any, frame: dict[str, str]):
-  vars = find_vars(expr) - set(frame)
-  for f in define_unbound(vars):
-    yield f | frame
+    if result is None:
+      if isinstance(v, str):
+        strs = [v]
+      else:
+        result = v
+    else:
+      tail = list(result) if isinstance(result, (str, tuple)) else [result]
+      if tail:
+        items = tail[::-1]
+        items.append(v)
+      else:
+        result = v
+
+  if items is not None:
+    return tuple(reversed(items))
+  if strs is not None:
+    return ''.join(reversed(strs))
+  return result
+
+def fold_chain(values):
+  """fold_values(values), or a LazyFold of them if any value is itself lazy"""
+  chain = values
+  while chain:
+    if isinstance(chain[0], Lazy):
+      return LazyFold(values)
+    chain = chain[1]
+  return fold_values(values)
+
+UNBUILT = object()
+
+class Lazy:
+  """A value resolve() hasn't built yet. Every count of a repeat yields a value, which backtracking mostly drops,
+  and building each would copy all the values before it. So they're only built once parse() has its results."""
+  __slots__ = 'value',
+
+class LazyFold(Lazy):
+  """fold_values(values)"""
+  __slots__ = 'values',
+
+  def __init__(self, values):
+    self.value = UNBUILT
+    self.values = values
+
+  def parts(self):
+    values = self.values
+    while values:
+      v, values, _ = values
+      yield v
+
+  def build(self):
+    value, self.values = fold_values(self.values), None
+    return value
+
+class LazyConcat(Lazy):
+  """str_concat(head, tail)"""
+  __slots__ = 'head', 'tail'
+
+  def __init__(self, head, tail):
+    self.value = UNBUILT
+    self.head = head
+    self.tail = tail
+
+  def parts(self):
+    return self.head, self.tail
+
+  def build(self):
+    head, tail = (v.value if isinstance(v, Lazy) else v for v in (self.head, self.tail))
+    self.head = self.tail = None
+    return str_concat(head, tail)
+
+class LazyRule(Lazy):
+  """make(name, start, end, expr), a show_parse rule value"""
+  __slots__ = 'make', 'name', 'start', 'end', 'expr'
+
+  def __init__(self, make, name, start, end, expr):
+    self.value = UNBUILT
+    self.make, self.name, self.start, self.end, self.expr = make, name, start, end, expr
+
+  def parts(self):
+    return self.expr,
+
+  def build(self):
+    value = self.make(self.name, self.start, self.end, self.expr.value)
+    self.make = self.expr = None
+    return value
+
+def built(value):
+  """value, with a Lazy built, along with the Lazy values inside it, without recursing"""
+  if not isinstance(value, Lazy):
+    return value
+  stack = [value]
+  while stack:
+    lazy = stack[-1]
+    if lazy.value is not UNBUILT:
+      stack.pop()
+      continue
+    pending = [v for v in lazy.parts() if isinstance(v, Lazy) and v.value is UNBUILT]
+    if pending:
+      stack.extend(pending)
+      continue
+    stack.pop()
+    lazy.value = lazy.build()
+  return value.value
+
+ENUM_NAMES = {value: name for name, value in ENUM_IDS.items()}
+
+@dataclass
+class RuleStats:
+  calls: int = 0
+  successes: int = 0
+  failures: int = 0
+  total: float = 0.0
+  self: float = 0.0
+  backtracks: int = 0
+
+class Profile:
+  """Counters and timings per rule call like ns-plain(0,FLOW-KEY), collected by Lib(profile=True).
+
+  A call succeeds if it yields any match, and each time the caller resumes it after a match is a backtrack.
+  total time includes nested rules, self time doesn't. Both only count time spent producing matches.
+  Calls accumulate over every parse until clear()."""
+
+  columns = 'calls', 'successes', 'failures', 'total', 'self', 'backtracks'
+
+  def __init__(self):
+    self.rules = {}
+    self.stacks = {}
+    self.active = []
+    self.child_time = []
+
+  def clear(self):
+    self.rules.clear()
+    self.stacks.clear()
+
+  def measure(self, label, results):
+    """Iterate results, attributing the time spent in each step to label"""
+    stats = self.rules.get(label)
+    if stats is None:
+      stats = self.rules[label] = RuleStats()
+    stats.calls += 1
+    found = 0
+    try:
+      while True:
+        self.active.append(label)
+        self.child_time.append(0.0)
+        start = time.perf_counter()
+        try:
+          v, end = next(results)
+        except StopIteration:
+          return
+        finally:
+          elapsed = time.perf_counter() - start
+          own = elapsed - self.child_time.pop()
+          if self.child_time:
+            self.child_time[-1] += elapsed
+          if label not in self.active[:-1]:  # Recursive calls are already in the outer call's total
+            stats.total += elapsed
+          stats.self += own
+          stack = tuple(self.active)
+          self.stacks[stack] = self.stacks.get(stack, 0.0) + own
+          self.active.pop()
+        found += 1
+        yield v, end
+        stats.backtracks += 1
+    finally:
+      if found:
+        stats.successes += 1
+      else:
+        stats.failures += 1
+
+  def table(self, sort='self', limit=None) -> str:
+    """Text table of the rules, slowest first by the sort column"""
+    rows = sorted(self.rules.items(), key=lambda item: getattr(item[1], sort), reverse=True)[:limit]
+    width = max([len('rule')] + [len(label) for label, _ in rows])
+    lines = [f"{'rule':{width}} {'calls':>9} {'ok':>9} {'failed':>9} {'total ms':>10} {'self ms':>10} {'backtracks':>10}"]
+    for label, s in rows:
+      lines.append(f'{label:{width}} {s.calls:9} {s.successes:9} {s.failures:9} {s.total * 1000:10.2f} '
+                   f'{s.self * 1000:10.2f} {s.backtracks:10}')
+    return '\n'.join(lines)
+
+  def collapsed(self) -> str:
+    """Self time in microseconds per stack of rule calls, in the collapsed format flamegraph.pl reads"""
+    return '\n'.join(f"{';'.join(stack)} {round(t * 1e6)}" for stack, t in sorted(self.stacks.items()) if round(t * 1e6))
+
+class ParseLimitExceeded(Exception):
+  """Lib.parse() stopped because reason ('max_steps', 'deadline' or 'cancelled') happened after steps rule entries.
+
+  farthest is the furthest position a rule was entered at, and rule_stack the rules being evaluated, outermost
+  first, like ['l-yaml-stream', 'l-any-document', ...]."""
+
+  def __init__(self, reason, steps, farthest, rule_stack):
+    super().__init__(reason, steps, farthest, rule_stack)
+    self.reason = reason
+    self.steps = steps
+    self.farthest = farthest
+    self.rule_stack = rule_stack
+
+  def __str__(self):
+    return f"{self.reason} after {self.steps} steps, at {self.farthest} in {' > '.join(self.rule_stack[-5:])}"
+
+# Limits other than max_steps cost a clock read, so they're only checked every this many steps
+CHECK_EVERY = 256
+
+@dataclass(frozen=True)
+class BatchResult:
+  """Outcome of one source in Lib.parse_many(): the parse result, or the exception parsing it raised"""
+  index: int
+  value: object = None
+  error: Exception = None
+
+# The Lib each parse_many() worker process parses with
+worker_lib = None
+
+def init_worker(lib, options):
+  global worker_lib
+  worker_lib = lib if lib is not None else Lib(**options)
+
+def worker_context(lib):
+  """(mp_context, initargs) for a ProcessPoolExecutor whose init_worker() processes parse like lib.
+
+  Only on Linux are the workers forked with a copy of lib; macOS can fork, but forking a process that has
+  started threads isn't safe there. Elsewhere each worker constructs a Lib from lib.options instead."""
+  if sys.platform.startswith('linux'):
+    return multiprocessing.get_context('fork'), (lib, None)
+  return None, (None, lib.options)
+
+def parse_source(lib, index, source, expr, max_steps=None) -> BatchResult:
+  try:
+    if isinstance(source, os.PathLike):
+      # Read as iter_documents() reads a path
+      source = ''.join(source_lines(source))
+    return BatchResult(index, lib.parse(source, expr, max_steps=max_steps))
+  except Exception as e:
+    return BatchResult(index, error=e)
+
+def parse_in_worker(index, source, expr, max_steps=None):
+  return parse_source(worker_lib, index, source, expr, max_steps)
+
+def parse_chunk_in_worker(items, expr, max_steps=None):
+  return [parse_in_worker(index, source, expr, max_steps) for index, source in items]
+
+def submit_chunk(pool, chunk, expr, max_steps):
+  try:
+    return pool.submit(parse_chunk_in_worker, chunk, expr, max_steps)
+  except BrokenProcessPool as e:
+    future = Future()
+    future.set_exception(e)
+    return future
+
+def chunk_results(future, chunk):
+  """The BatchResults of a parse_chunk_in_worker() future, or its exception for every source in chunk where the
+  pool broke or the results couldn't be pickled"""
+  try:
+    return future.result()
+  except Exception as e:
+    return [BatchResult(index, error=e) for index, _ in chunk]
+
+EVAL = 'eval'
+RETURN = 'return'
 
 class Lib:
 
-  def __init__(self, *, show_parse=False):
+  engines = ('tuple', 'compiled', 'stack', 'chart')
+
+  cache_dir = Path(__file__).parent / '__pycache__'
+
+  # Builds the value of a matched rule when show_parse is on; replaced by SpanTree.add_rule while parsing a span_tree
+  rule_value = ParseResult
+
+  def __init__(self, *, show_parse=False, span_tree=False, memo_size=None, engine='tuple', cache=True, profile=False):
+    """span_tree=True parses as show_parse does, but parse() returns a spans.SpanTree. Rules are recorded into its
+    arrays as they match, with the value of a rule being a spans.SpanNode handle on its node, so no ParseResult is
+    ever built. Nodes no handle reaches any more are swept from the arrays as they grow.
+
+    memo_size enables packrat memoization of rule and alternation results, keeping at most that many
+    (position, expr, frame) entries with LRU eviction. Results are stored as they are first consumed rather than
+    all resolved on a miss. It pays off where backtracking resolves the same rule at the same position again,
+    like nested flow collections, and otherwise costs its bookkeeping. Hit/miss counts are kept on
+    memo_hits/memo_misses. Only engine='tuple' memoizes this way, so any other engine raises ValueError for it.
+
+    engine='tuple' interprets the Bnf expressions directly in resolve(), engine='compiled' runs matcher closures
+    built once by compile_defs(), and engine='stack' interprets them in resolve_stack() without recursing, so
+    input length isn't limited by sys.getrecursionlimit(). engine='chart' first finds the end positions of every
+    rule with resolve_ends(), then builds values only for spans that are part of a whole parse, once per span, so
+    the work is polynomial in the input rather than exponential in its ambiguity, as long as the parse has
+    polynomially many values. Neither pass recurses, so like engine='stack' it parses input nested deeper than
+    sys.getrecursionlimit().
+
+    cache=True loads the parsed productions.bnf from cache_dir when its hash matches, and writes it otherwise.
+
+    profile=True records every rule call parse() makes in self.profile, a Profile. It isn't supported by
+    engine='stack' or engine='chart', and when off, no profiling code runs at all."""
+    if engine not in self.engines:
+      raise ValueError('engine', engine, 'not recognized')
+    if profile and engine in ('stack', 'chart'):
+      raise ValueError('profile', 'not supported by engine', engine)
+    if memo_size is not None and engine != 'tuple':
+      raise ValueError('memo_size', 'not supported by engine', engine)
     self.bnf = {}
-    self.load_defs()
-    self.show_parse = show_parse
+    self.load_defs(cache=cache)
+    # Only used when show_parse is off, as the nested rules inside a terminal don't produce ParseResults
+    self.terminals = Terminals(self.bnf)
+    self.entries = {}
+    self.plans = {}
+    self.char_classes = {}
+    self.def_vars = {}
+    self.options = dict(show_parse=show_parse, span_tree=span_tree, memo_size=memo_size, engine=engine, cache=cache,
+                        profile=profile)
+    self.show_parse = show_parse or span_tree
+    self.span_tree = span_tree
+    self.engine = engine
+    self.profile = Profile() if profile else None
+    self.labels = {}
+    if profile:
+      self.resolve_expr = self.resolve_expr_profiled
+    if engine == 'compiled':
+      self.compile_defs()
+    self.memo_size = memo_size
+    self.memo = OrderedDict()
+    self.memo_hits = 0
+    self.memo_misses = 0
 
-  def load_defs(self):
+  def load_defs(self, cache=False):
     productions_path = (Path(__file__).parent / 'productions.bnf').resolve()
-    with open(productions_path, 'r', encoding="utf-8") as f:
+    with open(productions_path, 'rb') as f:
       productions = f.read()
+    self.grammar_version = f'{LIB_VERSION}-{hashlib.sha256(productions).hexdigest()}'
 
-    for name, text in split_defs(productions):
+    cache_path = self.cache_dir / f'productions.{self.grammar_version[:20]}.pickle'
+    if cache and self.load_cache(cache_path):
+      return
+
+    for name, text in split_defs(productions.decode('utf-8')):
       _, name, *params = Bnf(name).expr
       try:
         rule = Bnf(text)
       except Exception as e:
         raise type(e)(f"{name}: {str(e)}").with_traceback(sys.exc_info()[2])
       self.bnf.setdefault(name, []).append((params, rule.expr))
+    self.index_firsts()
+
+    if cache:
+      self.save_cache(cache_path)
+
+  def load_cache(self, cache_path):
+    try:
+      with open(cache_path, 'rb') as f:
+        version, bnf, rule_firsts, firsts = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError, ValueError):
+      return False
+    if version != self.grammar_version:
+      return False
+    # Pickle keeps object identity within one dump, so each expr in firsts is the same object as in bnf
+    self.bnf = bnf
+    self.rule_firsts = rule_firsts
+    self.firsts = {id(expr): first for expr, first in firsts}
+    return True
 
-  def parse(self, text, expr):
+  def save_cache(self, cache_path):
+    # Write to a temp file then rename, so concurrent constructors never read a partial cache
+    try:
+      cache_path.parent.mkdir(parents=True, exist_ok=True)
+      fd, tmp = tempfile.mkstemp(dir=cache_path.parent, suffix='.tmp')
+      with os.fdopen(fd, 'wb') as f:
+        firsts = [(expr, self.firsts[id(expr)]) for expr in self.first_exprs]
+        pickle.dump((self.grammar_version, self.bnf, self.rule_firsts, firsts), f, pickle.HIGHEST_PROTOCOL)
+      os.replace(tmp, cache_path)
+    except OSError:
+      pass
+
+  def index_firsts(self):
+    """Compute First for every production (to a fixpoint, as rules are recursive) and every sub-expression.
+    self.firsts is keyed by id() of the sub-expressions in self.bnf, which outlive the index."""
+    self.rule_firsts = {name: First() for name in self.bnf}
+    changed = True
+    while changed:
+      changed = False
+      for name, defs in self.bnf.items():
+        first = First()
+        for _, expr in defs:
+          first |= first_set(expr, self.rule_firsts)
+        if first != self.rule_firsts[name]:
+          self.rule_firsts[name] = first
+          changed = True
+
+    self.firsts = {}
+    self.first_exprs = []
+    def index(expr):
+      match expr:
+        case set() | frozenset():
+          for e in expr:
+            self.firsts[id(e)] = first_set(e, self.rule_firsts)
+            self.first_exprs.append(e)
+            index(e)
+        case range():
+          pass
+        case (_, *es):
+          for e in es:
+            index(e)
+    for defs in self.bnf.values():
+      for _, expr in defs:
+        self.firsts[id(expr)] = first_set(expr, self.rule_firsts)
+        self.first_exprs.append(expr)
+        index(expr)
+
+  def can_start(self, expr, i):
+    """False only if expr certainly can't match at i. Expressions from outside self.bnf are never pruned"""
+    first = self.firsts.get(id(expr))
+    return first is None or first.allows(self.text, i)
+
+  def rule_result(self, name, start, end, expr):
+    """The value of rule name matching expr from start to end with show_parse, built later if expr is lazy"""
+    if isinstance(expr, Lazy):
+      return LazyRule(self.rule_value, name, start, end, expr)
+    return self.rule_value(name, start, end, expr)
+
+  def parse(self, text, expr, *, max_steps=None, deadline=None, cancel=None):
+    """The value of expr matching all of text, or a set if there are several.
+
+    Parsing stops with ParseLimitExceeded after max_steps rule entries, once time.monotonic() passes deadline,
+    or once cancel (a threading.Event, or anything with is_set()) is set. Without limits nothing is checked."""
     self.text = text
+    self.clear_tables()
 
-    results = set()
-    for result, lastI in self.resolve(0, expr, {}):
-      if lastI == len(text):
-        results.add(result)
+    limited = max_steps is not None or deadline is not None or cancel is not None
+    if limited:
+      self.rule_frames = self.limited_rule_frames(max_steps, deadline, cancel)
+    if self.span_tree:
+      from spans import SpanTree
+      nodes = SpanTree()
+      self.rule_value = nodes.add_rule
+    try:
+      if self.engine == 'compiled':
+        matches = self.compile_expr(expr)(0, EMPTY_FRAME)
+      elif self.engine == 'stack':
+        matches = self.resolve_stack(0, expr, EMPTY_FRAME)
+      elif self.engine == 'chart':
+        matches = self.resolve_chart(0, len(text), expr, EMPTY_FRAME)
+      else:
+        matches = self.resolve(0, expr, EMPTY_FRAME)
+
+      results = set()
+      for result, lastI in matches:
+        if lastI == len(text):
+          results.add(built(result))
+    finally:
+      self.clear_tables()
+      if limited:
+        del self.rule_frames
+      if self.span_tree:
+        del self.rule_value
 
     if not results:
       raise ValueError('no results')
+    if self.span_tree:
+      # Only the nodes reachable from a result are kept, and equal trees from different parses are merged
+      results = {SpanTree.from_value(result, nodes) for result in results}
     return solo(results)
 
-  enums = set('BLOCK-IN BLOCK-KEY BLOCK-OUT CLIP FLOW-IN FLOW-KEY FLOW-OUT KEEP STRIP'.split())
-  def new_frame(self, params, args, old_frame):
-    frame = {}
-    for param, arg in zip(params, (old_frame.get(arg, arg) for arg in args)):
-      if param.isdigit() or param in self.enums:
-        if param != arg: return None
-      elif param == 'n+1':
-        if arg == '0': return None
-        frame['n'] = str(int(arg)-1)
+  def clear_tables(self):
+    """Drops what one parse memoized, which can be far larger than its text, so it isn't kept until the next"""
+    self.memo.clear()
+    self.ends_memo = {}
+    self.matched = {}
+    self.spans = {}
+    self.suffixes = {}
+
+  def recognize(self, text, expr) -> bool:
+    """Whether expr matches all of text, like parse() succeeding, but without building any values"""
+    return len(text) in self.match_ends(text, 0, expr)
+
+  def match_ends(self, text, i, expr) -> set[int]:
+    """End positions of every match of expr starting at i"""
+    self.text = text
+    self.clear_tables()
+    try:
+      return self.resolve_ends(i, expr, EMPTY_FRAME)
+    finally:
+      self.clear_tables()
+
+  def iter_documents(self, source, expr=('rule', 'l-yaml-stream')):
+    """Parse each document of a YAML stream as soon as its text is read, yielding one parse result per document.
+
+    source is YAML text as a str or a path as an os.PathLike, as in parse_many(), or a text file object or an
+    iterable of str chunks. Only the current document is held in memory, so a stream of many documents can be
+    larger than memory but a single document can't."""
+    for doc in split_documents(source_lines(source)):
+      yield self.parse(doc, expr)
+
+  def parse_many(self, sources, expr=('rule', 'l-yaml-stream'), *, workers=None, ordered=True, chunksize=16,
+                 max_steps=None) -> Iterator[BatchResult]:
+    """Parse each source in a pool of worker processes, yielding a BatchResult per source.
+
+    A source is YAML text as a str, or a path as an os.PathLike, read by the worker. An exception parsing one
+    source is returned in its BatchResult instead of stopping the batch, so max_steps (as in parse()) can bound
+    pathological inputs. So is a worker dying or a result that can't be pickled, for each source of its chunk.
+    Results come in the order of sources, or as each finishes with ordered=False. workers defaults to
+    os.cpu_count(), and workers=1 parses in this process without a pool. sources is consumed as the pool gets to
+    it, with at most two chunks per worker read ahead.
+
+    On Linux, workers are forked with a copy of this Lib and its loaded grammar. Elsewhere each worker constructs
+    a Lib with the same options, which loads the grammar from the on-disk cache."""
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+      for index, source in enumerate(sources):
+        yield parse_source(self, index, source, expr, max_steps)
+      return
+
+    context, initargs = worker_context(self)
+    with ProcessPoolExecutor(workers, mp_context=context, initializer=init_worker, initargs=initargs) as pool:
+      items = enumerate(sources)
+      chunks = iter(lambda: list(itertools.islice(items, chunksize)), [])
+      in_flight = {submit_chunk(pool, chunk, expr, max_steps): chunk
+                   for chunk in itertools.islice(chunks, 2 * workers)}
+      while in_flight:
+        if ordered:
+          future = next(iter(in_flight))
+        else:
+          future = next(iter(wait(in_flight, return_when=FIRST_COMPLETED).done))
+        chunk = in_flight.pop(future)
+        for next_chunk in itertools.islice(chunks, 1):
+          in_flight[submit_chunk(pool, next_chunk, expr, max_steps)] = next_chunk
+        yield from chunk_results(future, chunk)
+
+  def enter(self, rule, frame):
+    """[(definition index, bound frame, inferred)] for calling rule = ('rule', name, *args) from frame.
+
+    Binding plans are built once per definition and call site, and the result is cached per (rule, frame), so
+    entering a rule again only costs a dict lookup. Variables the definition uses but its params don't bind
+    are left None in the bound frame, with [(slot, infer)] in inferred for rule_frames() to fill in."""
+    key = rule, frame
+    if (entries := self.entries.get(key)) is None:
+      entries = self.entries[key] = list(self.bind_rule(rule, frame))
+    return entries
+
+  def bind_rule(self, rule, frame):
+    _, name, *args = rule
+    for k, (params, expr) in enumerate(self.bnf[name]):
+      if len(params) != len(args):
+        raise ValueError("arity mismatch")
+
+      plan_key = id(expr), rule
+      if (plan := self.plans.get(plan_key)) is None:
+        plan = self.plans[plan_key] = binding_plan(params, args)
+      new_frame = plan(frame)
+      if new_frame is None: continue
+
+      if (slots := self.def_vars.get(id(expr))) is None:
+        slots = self.def_vars[id(expr)] = [VAR_SLOTS[v] for v in sorted(find_vars(expr))]
+      inferred = []
+      for slot in slots:
+        if new_frame[slot] is None:
+          if (infer := INFERRED.get((name, VARS[slot]))) is None:
+            raise ValueError(VARS[slot])
+          inferred.append((slot, infer))
+      yield k, new_frame, inferred
+
+  def limited_rule_frames(self, max_steps, deadline, cancel):
+    """rule_frames(), counting each call as a step and raising ParseLimitExceeded once a limit is hit.
+    Every engine enters rules through rule_frames(), so this bounds all of them."""
+    rule_frames = Lib.rule_frames.__get__(self)
+    steps = farthest = 0
+    def limited(rule, frame, i):
+      nonlocal steps, farthest
+      steps += 1
+      if i > farthest:
+        farthest = i
+      reason = None
+      if max_steps is not None and steps > max_steps:
+        reason = 'max_steps'
+      elif not steps % CHECK_EVERY:
+        if deadline is not None and time.monotonic() > deadline:
+          reason = 'deadline'
+        elif cancel is not None and cancel.is_set():
+          reason = 'cancelled'
+      if reason:
+        # Each engine adds the rules it's evaluating to rule_stack as the exception leaves them
+        raise ParseLimitExceeded(reason, steps, farthest, [])
+      return rule_frames(rule, frame, i)
+    return limited
+
+  def task_rules(self, tasks):
+    """Labels of the rules among the (task, expr, frame) of a task loop, outermost first"""
+    return [self.rule_label(expr, frame) for _, expr, frame in tasks if type(expr) is tuple and expr[0] == 'rule']
+
+  def rule_frames(self, rule, frame, i):
+    """(definition index, frame) for each definition of rule that can run at i, with unbound variables inferred"""
+    for k, bound_frame, inferred in self.enter(rule, frame):
+      if not inferred:
+        yield k, bound_frame
+        continue
+      frames = [bound_frame]
+      for slot, infer in inferred:
+        frames = [f[:slot] + (v,) + f[slot + 1:] for f in frames for v in infer(self.text, i, f)]
+      for f in frames:
+        yield k, f
+
+  def char_class(self, expr, frame) -> First:
+    """First of the characters expr matches in frame, if expr only ever matches exactly one character, else None.
+
+    Rules with args are followed into the definitions they bind to, so ns-plain-safe(c) is a class once c is known."""
+    key = expr, frame
+    if key in self.char_classes:
+      return self.char_classes[key]
+    self.char_classes[key] = None  # Until proven otherwise, which also stops recursive rules
+
+    options = None
+    if intervals := char_intervals(expr):
+      options = [intervals_first(intervals)]
+    else:
+      match expr:
+        case set() | frozenset():
+          options = [self.char_class(e, frame) for e in expr]
+        case ('rule', name) if (terminal := self.terminals[name]) and terminal.chars:
+          options = [intervals_first(terminal.chars)]
+        case ('rule', name, *_):
+          entries = self.enter(expr, frame)
+          if not any(inferred for _, _, inferred in entries):
+            options = [self.char_class(self.bnf[name][k][1], f) for k, f, _ in entries]
+
+    first = None
+    if options and all(options):
+      first = First()
+      for o in options:
+        first |= o
+    self.char_classes[key] = first
+    return first
+
+  def any_match(self, i, expr, frame) -> bool:
+    """Whether expr matches at i at all, cached per position for the current text like a diff subtrahend"""
+    key = i, id(expr), frame
+    if (found := self.matched.get(key)) is None:
+      found = self.matched[key] = bool(self.resolve_ends(i, expr, frame))
+    return found
+
+  def lookaround(self, i, expr, frame) -> bool:
+    """Whether the zero-width ('?=', e), ('?!', e) or ('?<=', e) holds at i.
+    Single-character e is checked directly against the neighbouring character of self.text."""
+    kind, e = expr
+    if first := self.char_class(e, frame):
+      if kind == '?<=':
+        return i > 0 and bool(first.allows(self.text, i - 1))
+      return bool(first.allows(self.text, i)) == (kind == '?=')
+    if kind == '?<=':
+      return any(i in self.resolve_ends(j, e, frame) for j in range(i, -1, -1))
+    return self.any_match(i, e, frame) == (kind == '?=')
+
+  def resolve(self, i: int, expr: any, frame: tuple) -> Iterator[tuple[object, int]]:
+    if self.memo_size is None:
+      return self.resolve_expr(i, expr, frame)
+    match expr:
+      case ('rule', *_) | frozenset():
+        pass
+      case _:
+        return self.resolve_expr(i, expr, frame)
+
+    # Rules and alternations are owned by self.bnf (or the caller's expr) so their id() is stable while memoized;
+    # the entry keeps a reference to expr so the id can't be reused.
+    key = i, id(expr), frame
+    if entry := self.memo.get(key):
+      self.memo.move_to_end(key)
+      self.memo_hits += 1
+      return iter(entry[1]) if entry[2] is None else self.memo_results(entry)
+
+    self.memo_misses += 1
+    entry = self.memo[key] = [expr, [], self.resolve_expr(i, expr, frame)]
+    if len(self.memo) > self.memo_size:
+      self.memo.popitem(last=False)
+    return self.memo_results(entry)
+
+  def memo_results(self, entry):
+    """The results of a memo entry [expr, results, pending], where results are the ones resolved so far and
+    pending the generator resolving the rest, or None once it's done. Results are only resolved as a caller
+    needs them, so one that stops early doesn't pay for the rest."""
+    results = entry[1]
+    n = 0
+    while True:
+      if n < len(results):
+        yield results[n]
+        n += 1
+        continue
+      if (pending := entry[2]) is None:
+        return
+      for result in pending:
+        results.append(result)
+        n += 1
+        yield result
+        if n < len(results):
+          break  # Another caller resolved more while this one was suspended
       else:
-        if not param.isalpha():
-          raise NotImplementedError(param)
-        frame[param] = arg
-    return frame
+        entry[2] = None
+        return
+
+  def rule_label(self, rule, frame):
+    """Spec notation for a rule call with its arguments evaluated in frame, like s-indent(2)"""
+    key = rule, frame
+    if (label := self.labels.get(key)) is None:
+      _, name, *args = rule
+      values = []
+      for arg in args:
+        try:
+          value = compile_arg(arg)(frame)
+        except (ValueError, KeyError):
+          value = arg
+        values.append(ENUM_NAMES.get(value, str(value)))
+      label = self.labels[key] = f"{name}({','.join(values)})" if args else name
+    return label
 
-  def resolve(self, i: int, expr: any, frame: dict[str, str]) -> Iterator[tuple[object, int]]:
+  def resolve_expr_profiled(self, i: int, expr: any, frame: tuple) -> Iterator[tuple[object, int]]:
+    results = Lib.resolve_expr(self, i, expr, frame)
+    if type(expr) is tuple and expr[0] == 'rule':
+      return self.profile.measure(self.rule_label(expr, frame), results)
+    return results
+
+  def resolve_expr(self, i: int, expr: any, frame: tuple) -> Iterator[tuple[object, int]]:
     match expr:
       case str(s):
-        if i < len(self.text) and self.text[i] == s:
-          yield s, i + 1
+        if self.text.startswith(s, i):
+          yield s, i + len(s)
       case range():
         if i < len(self.text) and ord(self.text[i]) in expr:
           yield self.text[i], i + 1
       case set() | frozenset():
         for e in expr:
-          yield from self.resolve(i, e, frame)
+          if self.can_start(e, i):
+            yield from self.resolve(i, e, frame)
       case ('concat',):
         yield None, i
       case ('concat', e, *exprs):
@@ -304,35 +1410,34 @@ class Lib:
           for vvv, iii in self.resolve(ii, ('concat', *exprs), frame):
             yield str_concat(vv, vvv), iii
       case ('repeat', lo, hi, e):
-        if not lo:
-          yield None, i
-        if hi:
-          dec = ('repeat', max(lo - 1, 0), hi - 1, e)
-          for vv, ii in self.resolve(i, e, frame):
-            for vvv, iii in self.resolve(ii, dec, frame):
-              yield str_concat(vv, vvv), iii
+        yield from self.resolve_repeat(i, lo, hi, lambda ii: self.resolve(ii, e, frame))
       case ('rule', name, *args):
-        for params, expr in self.bnf[name]:
-          if len(params) != len(args):
-            raise ValueError("arity mismatch")
-
-          new_frame = self.new_frame(params, args, frame)
-          if new_frame is None: continue
+        if not args and not self.show_parse and (terminal := self.terminals[name]):
+          for end in terminal.ends(self.text, i):
+            yield self.text[i:end] if end > i else None, end
+          return
 
-          for bound_frame in automagically_define_unbound(expr, new_frame):
-            rec = self.resolve(i, expr, bound_frame)
+        defs = self.bnf[name]
+        try:
+          for k, bound_frame in self.rule_frames(expr, frame, i):
+            body = defs[k][1]
+            if not self.can_start(body, i): continue
 
+            rec = self.resolve(i, body, bound_frame)
             if self.show_parse:
               for e, ii in rec:
-                yield ParseResult(name, i, ii, e), ii
+                yield self.rule_result(name, i, ii, e), ii
             else:
               yield from rec
+        except ParseLimitExceeded as e:
+          e.rule_stack.insert(0, self.rule_label(expr, frame))
+          raise
       case ('diff', e, *subtrahends):
-        for s in subtrahends:
-          for o in self.resolve(i, s, frame):
-            return
-        if not any(any(self.resolve(i, s, frame)) for s in subtrahends):
+        if not any(self.any_match(i, s, frame) for s in subtrahends):
           yield from self.resolve(i, e, frame)
+      case ('?=' | '?!' | '?<=', _):
+        if self.lookaround(i, expr, frame):
+          yield '', i
       case ('^',):
         if i == 0 or self.text[i - 1] == '\n':
           yield '', i
@@ -341,3 +1446,536 @@ class Lib:
           yield '', i
       case _:
         raise ValueError('unknown type:', expr)
+
+  def resolve_ends(self, i: int, expr: any, frame: tuple) -> set[int]:
+    """The set of end positions resolve(i, expr, frame) would yield. Rule results are memoized in ends_memo, and
+    concats and repeats advance a set of positions, so equal ends are only ever expanded once.
+
+    Sub-expressions are evaluated by looping over a stack of ends_task() generators instead of recursing, so
+    deeply nested input isn't limited by sys.getrecursionlimit()."""
+    if (ends := self.leaf_ends(i, expr, frame)) is not None:
+      return ends
+    tasks = [(self.ends_task(i, expr, frame), expr, frame)]
+    try:
+      while True:
+        try:
+          request = tasks[-1][0].send(ends)
+        except StopIteration as done:
+          tasks.pop()
+          ends = done.value
+          if not tasks:
+            return ends
+          continue
+        if (ends := self.leaf_ends(*request)) is None:
+          tasks.append((self.ends_task(*request), *request[1:]))
+    except ParseLimitExceeded as e:
+      e.rule_stack[:0] = self.task_rules(tasks)
+      raise
+
+  def leaf_ends(self, i, expr, frame) -> set[int] | None:
+    """resolve_ends() of an expression that doesn't need its sub-expressions evaluated, else None"""
+    text = self.text
+    match expr:
+      case str(s):
+        return {i + len(s)} if text.startswith(s, i) else set()
+      case range():
+        return {i + 1} if i < len(text) and ord(text[i]) in expr else set()
+      case ('rule', name, *args):
+        if not args and (terminal := self.terminals[name]):
+          return set(terminal.ends(text, i))
+        return self.ends_memo.get((i, id(expr), frame))
+      case ('?=' | '?!' | '?<=', _):
+        return {i} if self.lookaround(i, expr, frame) else set()
+      case ('^',):
+        return {i} if i == 0 or text[i - 1] == '\n' else set()
+      case ('$',):
+        return {i} if i == len(text) else set()
+      case set() | frozenset() | ('concat', *_) | ('repeat', *_) | ('diff', *_):
+        return None
+      case _:
+        raise ValueError('unknown type:', expr)
+
+  def ends_task(self, i, expr, frame):
+    """Generator for resolve_ends() of a compound expression. It yields (i, expr, frame) for each sub-expression
+    it needs, is sent back the ends of each, and returns its own ends."""
+    match expr:
+      case set() | frozenset():
+        ends = set()
+        for e in expr:
+          if self.can_start(e, i):
+            ends |= (yield i, e, frame)
+        return ends
+      case ('concat', *exprs):
+        positions = {i}
+        for e in exprs:
+          next_positions = set()
+          for p in positions:
+            next_positions |= (yield p, e, frame)
+          positions = next_positions
+        return positions
+      case ('repeat', lo, hi, e):
+        ends, positions, count = set(), {i}, 0
+        while positions:
+          if count >= lo:
+            ends |= positions
+          if count == hi:
+            break
+          next_positions = set()
+          for p in positions:
+            next_positions |= (yield p, e, frame)
+          positions = next_positions
+          if hi == math.inf and count >= lo:
+            positions -= ends
+          count += 1
+        return ends
+      case ('rule', name, *args):
+        ends = set()
+        defs = self.bnf[name]
+        for k, bound_frame in self.rule_frames(expr, frame, i):
+          body = defs[k][1]
+          if self.can_start(body, i):
+            ends |= (yield i, body, bound_frame)
+        self.ends_memo[i, id(expr), frame] = ends
+        return ends
+      case ('diff', e, *subtrahends):
+        if any(self.any_match(i, s, frame) for s in subtrahends):
+          return set()
+        return (yield i, e, frame)
+
+  def resolve_repeat(self, i, lo, hi, step):
+    """(value, end) of every lo..hi repetitions of step(i) -> Iterator[(value, end)], with the values nested
+    resolve() calls would build. Iterations advance a frontier of distinct (end, values so far) instead of
+    recursing, so repeated matches are only expanded once and a run of n matches costs n steps.
+
+    values so far are interned linked lists (value, values, plain) where plain means every value is a str, in
+    which case the folded value is just the matched text. Otherwise it's a LazyFold, so yielding a count doesn't
+    copy every value before it."""
+    text = self.text
+    cells = {}
+    def extend(values, v):
+      key = v, id(values)
+      if (cell := cells.get(key)) is None:
+        cell = cells[key] = v, values, isinstance(v, str) and (values is None or values[2])
+      return cell
+
+    def value(values, end):
+      if values is None:
+        return None
+      if not values[2]:
+        return LazyFold(values)
+      return text[i:end]
+
+    # Keyed by (end, id(values)); the interned cells make identity the same as equality, without hashing the chain
+    frontier = {(i, id(None)): (i, None)}
+    count = 0
+    while frontier:
+      if count >= lo:
+        for end, values in frontier.values():
+          yield value(values, end), end
+      if count == hi:
+        return
+      count += 1
+
+      next_frontier = {}
+      for pos, values in frontier.values():
+        for v, end in step(pos):
+          # Once lo is met, an empty iteration of an unbounded repeat reaches no new position
+          if end == pos and hi == math.inf and count > lo:
+            continue
+          values_ = extend(values, v)
+          next_frontier[end, id(values_)] = end, values_
+      frontier = next_frontier
+
+  def resolve_stack(self, i: int, expr: any, frame: tuple) -> Iterator[tuple[object, int]]:
+    """Same results as resolve(), but driven by an explicit stack of tasks instead of nested generators.
+
+    A task either evaluates (EVAL, i, expr, frame, k) or returns (RETURN, value, i, k) to continuation k, a linked
+    list of what to do with a value: ('concat', expr, next_index, frame, values, k),
+    ('repeat', lo, hi, e, frame, values, origin, start, k), ('rule', rule, frame, start, k), or None to yield it.
+    values is a linked list (value, values, plain) of the items matched so far, newest first, as in
+    resolve_repeat(). The 'rule' continuations are the rules being evaluated, for ParseLimitExceeded.rule_stack."""
+    text = self.text
+    stack = [(EVAL, i, expr, frame, None)]
+
+    def push_repeat(i, lo, hi, e, frame, values, origin, k):
+      if not lo:
+        stack.append((RETURN, text[origin:i] if values and values[2] else values and LazyFold(values), i, k))
+      if hi:
+        stack.append((EVAL, i, e, frame, ('repeat', lo, hi, e, frame, values, origin, i, k)))
+
+    try:
+      while stack:
+        task = stack.pop()
+        if task[0] is RETURN:
+          _, v, i, k = task
+          match k:
+            case None:
+              yield v, i
+            case ('concat', expr, n, frame, values, k):
+              values = v, values, None
+              if n == len(expr):
+                stack.append((RETURN, fold_chain(values), i, k))
+              else:
+                stack.append((EVAL, i, expr[n], frame, ('concat', expr, n + 1, frame, values, k)))
+            case ('repeat', lo, hi, e, frame, values, origin, start, k):
+              # Once lo is met, an empty iteration of an unbounded repeat reaches no new position
+              if i != start or hi != math.inf or lo:
+                values = v, values, isinstance(v, str) and (values is None or values[2])
+                push_repeat(i, max(lo - 1, 0), hi - 1, e, frame, values, origin, k)
+            case ('rule', rule, frame, start, k):
+              stack.append((RETURN, self.rule_result(rule[1], start, i, v) if self.show_parse else v, i, k))
+          continue
+
+        _, i, expr, frame, k = task
+        match expr:
+          case str(s):
+            if text.startswith(s, i):
+              stack.append((RETURN, s, i + len(s), k))
+          case range():
+            if i < len(text) and ord(text[i]) in expr:
+              stack.append((RETURN, text[i], i + 1, k))
+          case set() | frozenset():
+            for e in expr:
+              if self.can_start(e, i):
+                stack.append((EVAL, i, e, frame, k))
+          case ('concat',):
+            stack.append((RETURN, None, i, k))
+          case ('concat', e, *_):
+            stack.append((EVAL, i, e, frame, ('concat', expr, 2, frame, None, k)))
+          case ('repeat', lo, hi, e):
+            push_repeat(i, lo, hi, e, frame, None, i, k)
+          case ('rule', name, *args):
+            if not args and not self.show_parse and (terminal := self.terminals[name]):
+              for end in terminal.ends(text, i):
+                stack.append((RETURN, text[i:end] if end > i else None, end, k))
+              continue
+
+            defs = self.bnf[name]
+            rule_k = ('rule', expr, frame, i, k)
+            for d, bound_frame in self.rule_frames(expr, frame, i):
+              body = defs[d][1]
+              if self.can_start(body, i):
+                stack.append((EVAL, i, body, bound_frame, rule_k))
+          case ('diff', e, *subtrahends):
+            # Only nests as deep as the subtrahend grammar, which never nests with the input
+            if not any(self.any_match(i, s, frame) for s in subtrahends):
+              stack.append((EVAL, i, e, frame, k))
+          case ('?=' | '?!' | '?<=', _):
+            if self.lookaround(i, expr, frame):
+              stack.append((RETURN, '', i, k))
+          case ('^',):
+            if i == 0 or text[i - 1] == '\n':
+              stack.append((RETURN, '', i, k))
+          case ('$',):
+            if i == len(text):
+              stack.append((RETURN, '', i, k))
+          case _:
+            raise ValueError('unknown type:', expr)
+    except ParseLimitExceeded as e:
+      rules = []
+      if task[0] is EVAL and type(task[2]) is tuple and task[2][0] == 'rule':
+        rules.append(self.rule_label(task[2], task[3]))
+      k = task[-1]
+      while k:
+        if k[0] == 'rule':
+          rules.append(self.rule_label(k[1], k[2]))
+        k = k[-1]
+      e.rule_stack[:0] = rules[::-1]
+      raise
+
+  def resolve_chart(self, i: int, j: int, expr: any, frame: tuple) -> Iterator[tuple[object, int]]:
+    """(value, j) for each value resolve() yields for expr from i to j, without expanding any match that can't
+    end at j. Needs parse() to have reset the chart for self.text."""
+    if j in self.chart_ends(i, expr, frame):
+      for v in self.span_values(i, j, expr, frame):
+        yield v, j
+
+  def chart_ends(self, i, expr, frame) -> set[int]:
+    """resolve_ends(), memoized for every expression rather than just rules"""
+    key = i, id(expr), frame
+    if (ends := self.ends_memo.get(key)) is None:
+      ends = self.ends_memo[key] = self.resolve_ends(i, expr, frame)
+    return ends
+
+  def span_values(self, i: int, j: int, expr: any, frame: tuple) -> set:
+    """Every value resolve(i, expr, frame) yields ending at j, which must be in chart_ends(i, expr, frame).
+    Memoized per span, so values shared by several parses of an ambiguous input are only built once.
+
+    Like resolve_ends(), sub-spans are evaluated by looping over a stack of values_task() generators."""
+    if (values := self.leaf_values(i, j, expr, frame)) is not None:
+      return values
+    tasks = [(self.values_task(i, j, expr, frame), expr, frame)]
+    try:
+      while True:
+        try:
+          request = tasks[-1][0].send(values)
+        except StopIteration as done:
+          tasks.pop()
+          values = done.value
+          if not tasks:
+            return values
+          continue
+        if (values := self.leaf_values(*request)) is None:
+          tasks.append((self.values_task(*request), *request[2:]))
+    except ParseLimitExceeded as e:
+      e.rule_stack[:0] = self.task_rules(tasks)
+      raise
+
+  def leaf_values(self, i, j, expr, frame) -> set | None:
+    """span_values() of an expression that doesn't need its sub-spans evaluated, else None"""
+    match expr:
+      case str(s):
+        return {s}
+      case range():
+        return {self.text[i]}
+      case ('?=' | '?!' | '?<=', _) | ('^',) | ('$',):
+        return {''}
+      case ('rule', name) if not self.show_parse and self.terminals[name]:
+        return {self.text[i:j] if j > i else None}
+      case ('diff', *_):
+        return None
+    return self.spans.get((i, j, id(expr), frame))
+
+  def values_task(self, i, j, expr, frame):
+    """Generator for span_values() of a compound expression. It yields (i, j, expr, frame) for each sub-span it
+    needs, is sent back the values of each, and returns its own."""
+    match expr:
+      case ('diff', e, *_):
+        # j is only an end of the diff if no subtrahend matched
+        return (yield i, j, e, frame)
+      case set() | frozenset():
+        values = set()
+        for e in expr:
+          if self.can_start(e, i) and j in self.chart_ends(i, e, frame):
+            values |= (yield i, j, e, frame)
+      case ('concat', *_):
+        values = yield from self.concat_values(i, j, expr, 1, frame)
+      case ('repeat', lo, hi, e):
+        values = yield from self.repeat_values(i, j, lo, hi, e, frame)
+      case ('rule', name, *args):
+        values = set()
+        defs = self.bnf[name]
+        for k, bound_frame in self.rule_frames(expr, frame, i):
+          body = defs[k][1]
+          if self.can_start(body, i) and j in self.chart_ends(i, body, bound_frame):
+            body_values = yield i, j, body, bound_frame
+            values |= {self.rule_value(name, i, j, v) for v in body_values} if self.show_parse else body_values
+      case _:
+        raise ValueError('unknown type:', expr)
+    self.spans[i, j, id(expr), frame] = values
+    return values
+
+  def suffix_ends(self, i, expr, n, frame) -> set[int]:
+    """End positions of matching ('concat', *expr[n:]) from i"""
+    if n == len(expr):
+      return {i}
+    key = i, id(expr), n, frame
+    if (ends := self.suffixes.get(key)) is None:
+      ends = self.suffixes[key] = {end for p in self.chart_ends(i, expr[n], frame)
+                                   for end in self.suffix_ends(p, expr, n + 1, frame)}
+    return ends
+
+  def concat_values(self, i, j, expr, n, frame):
+    """Part of values_task() for ('concat', *expr[n:]), folded with str_concat() from the right as resolve()
+    does. Only nests as deep as the concat is long."""
+    if n == len(expr):
+      return {None}
+    key = i, j, id(expr), n, frame
+    if (values := self.spans.get(key)) is not None:
+      return values
+
+    values = set()
+    for p in self.chart_ends(i, expr[n], frame):
+      if p <= j and j in self.suffix_ends(p, expr, n + 1, frame):
+        heads = yield i, p, expr[n], frame
+        tails = yield from self.concat_values(p, j, expr, n + 1, frame)
+        values.update(str_concat(v, w) for v in heads for w in tails)
+    self.spans[key] = values
+    return values
+
+  def repeat_values(self, i, j, lo, hi, e, frame):
+    """Part of values_task() for ('repeat', lo, hi, e), with the values resolve_repeat() builds.
+
+    Iterations are states (position, count), where an unbounded repeat stops counting at lo as the count no
+    longer changes which iterations are allowed. Only the states that can still reach j are extended, in order
+    of position then count, so each state has all its values so far before any are extended."""
+    def counted(count):
+      return min(count, lo) if hi == math.inf else count
+
+    # Every state reachable from i without passing j
+    edges = {}
+    todo = [(i, 0)]
+    while todo:
+      state = todo.pop()
+      if state in edges:
+        continue
+      pos, count = state
+      edges[state] = nexts = []
+      if count == hi:
+        continue
+      for end in self.chart_ends(pos, e, frame):
+        # Once lo is met, an empty iteration of an unbounded repeat reaches no new position
+        if end > j or (end == pos and hi == math.inf and count >= lo):
+          continue
+        nexts.append((end, counted(count + 1)))
+        todo.append(nexts[-1])
+
+    sources = {}
+    for state, nexts in edges.items():
+      for n in nexts:
+        sources.setdefault(n, []).append(state)
+    live = {(pos, count) for pos, count in edges if pos == j and count >= lo}
+    todo = list(live)
+    while todo:
+      for state in sources.get(todo.pop(), ()):
+        if state not in live:
+          live.add(state)
+          todo.append(state)
+
+    text = self.text
+    items = {}
+    for state in sorted(live):
+      for n in edges[state]:
+        if n in live:
+          items[state, n] = yield state[0], n[0], e, frame
+    if all(isinstance(v, str) for values in items.values() for v in values):
+      # Every way to split the span folds to its text, so there's no need to tell them apart
+      results = {text[i:j]} if items else set()
+      if i == j and not lo:
+        results.add(None)
+      return results
+
+    # Values so far are the interned linked lists of resolve_repeat(), keyed by id() so chains are never hashed
+    cells = {}
+    def extend(values, v):
+      key = v, id(values)
+      if (cell := cells.get(key)) is None:
+        cell = cells[key] = v, values, isinstance(v, str) and (values is None or values[2])
+      return cell
+
+    chains = {(i, 0): {id(None): None}}
+    results = set()
+    for state in sorted(live):
+      pos, count = state
+      values = chains.pop(state, {})
+      if pos == j and count >= lo:
+        results.update(text[i:j] if chain and chain[2] else fold_values(chain) for chain in values.values())
+      for n in edges[state]:
+        if n in live:
+          extended = chains.setdefault(n, {})
+          for chain in values.values():
+            for v in items[state, n]:
+              cell = extend(chain, v)
+              extended[id(cell)] = cell
+    return results
+
+  def compile_defs(self):
+    """Compile every production into matcher closures, stored as self.compiled[name] = [(first, matcher)]"""
+    # Lists are created up front so rule matchers can capture them before the referenced rule is compiled
+    self.compiled = {name: [] for name in self.bnf}
+    for name, defs in self.bnf.items():
+      for params, expr in defs:
+        self.compiled[name].append((self.firsts[id(expr)], self.compile_expr(expr)))
+
+  def compile_expr(self, expr):
+    """Returns a function (i, frame) -> Iterator[(value, end)] matching the same input as resolve(i, expr, frame)"""
+    match expr:
+      case str(s):
+        n = len(s)
+        def match_str(i, frame):
+          if self.text.startswith(s, i):
+            yield s, i + n
+        return match_str
+      case range():
+        def match_range(i, frame):
+          text = self.text
+          if i < len(text) and ord(text[i]) in expr:
+            yield text[i], i + 1
+        return match_range
+      case set() | frozenset():
+        options = [(self.firsts.get(id(e)) or first_set(e, self.rule_firsts), self.compile_expr(e)) for e in expr]
+        def match_or(i, frame):
+          for first, m in options:
+            if first.allows(self.text, i):
+              yield from m(i, frame)
+        return match_or
+      case ('concat',):
+        def match_empty(i, frame):
+          yield None, i
+        return match_empty
+      case ('concat', e):
+        # str_concat(v, None) is always v
+        return self.compile_expr(e)
+      case ('concat', e, *exprs):
+        head = self.compile_expr(e)
+        tail = self.compile_expr(('concat', *exprs))
+        def match_concat(i, frame):
+          for vv, ii in head(i, frame):
+            for vvv, iii in tail(ii, frame):
+              yield str_concat(vv, vvv), iii
+        return match_concat
+      case ('repeat', lo, hi, e):
+        m = self.compile_expr(e)
+        def match_repeat(i, frame):
+          return self.resolve_repeat(i, lo, hi, lambda ii: m(ii, frame))
+        return match_repeat
+      case ('rule', *_):
+        match_rule = self.compile_rule(expr)
+        if self.profile:
+          def match_rule_profiled(i, frame):
+            return self.profile.measure(self.rule_label(expr, frame), match_rule(i, frame))
+          return match_rule_profiled
+        return match_rule
+      case ('diff', e, *subtrahends):
+        m = self.compile_expr(e)
+        def match_diff(i, frame):
+          if not any(self.any_match(i, s, frame) for s in subtrahends):
+            yield from m(i, frame)
+        return match_diff
+      case ('?=' | '?!' | '?<=', _):
+        def match_lookaround(i, frame):
+          if self.lookaround(i, expr, frame):
+            yield '', i
+        return match_lookaround
+      case ('^',):
+        def match_start(i, frame):
+          if i == 0 or self.text[i - 1] == '\n':
+            yield '', i
+        return match_start
+      case ('$',):
+        def match_end(i, frame):
+          if i == len(self.text):
+            yield '', i
+        return match_end
+      case _:
+        # Same as resolve(), unsupported expressions only fail once they are reached
+        def match_unknown(i, frame):
+          raise ValueError('unknown type:', expr)
+          yield
+        return match_unknown
+
+  def compile_rule(self, rule):
+    _, name, *args = rule
+    if not args and not self.show_parse and (terminal := self.terminals[name]):
+      def match_terminal(i, frame):
+        text = self.text
+        for end in terminal.ends(text, i):
+          yield text[i:end] if end > i else None, end
+      return match_terminal
+
+    defs = self.compiled[name]
+    def match_rule(i, frame):
+      try:
+        for k, bound_frame in self.rule_frames(rule, frame, i):
+          first, m = defs[k]
+          if not first.allows(self.text, i): continue
+
+          if self.show_parse:
+            for e, ii in m(i, bound_frame):
+              yield self.rule_result(name, i, ii, e), ii
+          else:
+            yield from m(i, bound_frame)
+      except ParseLimitExceeded as e:
+        e.rule_stack.insert(0, self.rule_label(rule, frame))
+        raise
+    return match_rule
@@ -1,13 +1,25 @@
+from array import array
 import base64
+import binascii
 import datetime
 import math
 import re
 
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
 
 _fail = object()
 
+# Compiled once per pattern, instead of building the pattern string on every call
+patterns = {}
+
 def exact_match(pattern, s):
-  return re.match('^(?:' + pattern + '\n)$', s, re.VERBOSE)
+  if not (compiled := patterns.get(pattern)):
+    compiled = patterns[pattern] = re.compile('^(?:' + pattern + '\n)$', re.VERBOSE)
+  return compiled.match(s)
 
 def parse_bool(s):
   if exact_match(r'y|Y|yes|Yes|YES|true|True|TRUE|on|On|ON', s):
@@ -24,7 +36,33 @@ def parse_null(s):
     return None
   return _fail
 
+def is_digits(s):
+  return s.isascii() and s.isdigit()
+
+def split_sign(s):
+  return (s[0], s[1:]) if s[:1] in ('-', '+') else ('', s)
+
+def plain_int(s):
+  """Whether s is a decimal int without underscores, where int(s) is its value"""
+  _, body = split_sign(s)
+  return is_digits(body) and (body[0] != '0' or body == '0')
+
+def plain_float(s):
+  """Whether s is a float like 1.5, -.5 or 2.5e-3 without underscores, where float(s) is its value"""
+  _, body = split_sign(s)
+  for e in 'eE':
+    if e in body:
+      body, _, exponent = body.partition(e)
+      if exponent[:1] not in ('-', '+') or not is_digits(exponent[1:]):
+        return False
+      break
+  head, dot, tail = body.partition('.')
+  return bool(dot and (head or tail)) and (not head or is_digits(head)) and (not tail or is_digits(tail))
+
 def parse_int(s):
+  if plain_int(s):
+    return int(s)
+
   mult = 1
   if s[0] == '+':
     s = s[1:]
@@ -38,10 +76,7 @@ def parse_int(s):
 
   sexagesimal = None
   if m := exact_match(r'[1-9][0-9_]*(:[0-5]?[0-9])', s):
-    n = 0
-    for p in s.split(':'):
-      n = n * 60 + int(p)
-    sexagesimal = n
+    sexagesimal = sexagesimal_int(s)
 
 
   return next(n for n in (
@@ -54,6 +89,9 @@ def parse_int(s):
    ) if n is not None)
 
 def parse_float(s):
+  if plain_float(s):
+    return float(s)
+
   if exact_match(r'0+', s):
     return 0.0
 
@@ -75,17 +113,53 @@ def parse_float(s):
     return mult * float(s.replace('_', ''))
 
   if exact_match(r'[0-9][0-9_]*(:[0-5]?[0-9])+\.[0-9_]*', s):
-    ss = 0.0
-    for p in s.split(':'):
-      ss = ss * 60 + float(p.replace('_', ''))
-    return ss
+    return sexagesimal_float(s)
 
   return _fail
 
+def sexagesimal_int(s):
+  n = 0
+  for p in s.split(':'):
+    n = n * 60 + int(p)
+  return n
+
+def sexagesimal_float(s):
+  ss = 0.0
+  for p in s.split(':'):
+    ss = ss * 60 + float(p.replace('_', ''))
+  return ss
+
 def zfill_digits(s):
   return re.sub(r'(?<!\d)(\d)(?!\d)', r'0\1', s)
 
+def canonical_timestamp(s):
+  """Timestamp value of YYYY-MM-DD or YYYY-MM-DDThh:mm:ss with up to 6 fraction digits and a Z or ±hh:mm zone,
+  checked by position and handed to fromisoformat as parse_timestamp would. _fail for any other spelling, which
+  is left to the regex in parse_timestamp"""
+  if not (s.isascii() and s[4:5] == '-' and s[7:8] == '-' and s[:4].isdigit() and s[5:7].isdigit()
+          and s[8:10].isdigit()):
+    return _fail
+  if len(s) == 10:
+    return datetime.datetime.fromisoformat(s).replace(tzinfo=datetime.timezone.utc)
+  if not (s[10:11] in ('T', 't') and s[13:14] == ':' and s[16:17] == ':' and s[11:13].isdigit()
+          and s[14:16].isdigit() and s[17:19].isdigit()):
+    return _fail
+
+  rest = s[19:]
+  zone = rest[1:].lstrip('0123456789') if rest[:1] == '.' else rest
+  fraction = rest[1:len(rest) - len(zone)]
+  if len(fraction) > 6:
+    return _fail
+  if zone in ('', 'Z'):
+    zone = '+00:00'
+  elif not (len(zone) == 6 and zone[0] in '-+' and zone[3] == ':' and zone[1:3].isdigit() and zone[4:].isdigit()):
+    return _fail
+  return datetime.datetime.fromisoformat(f'{s[:10]}T{s[11:19]}.{fraction.ljust(6, "0")}{zone}')
+
 def parse_timestamp(s):
+  if (val := canonical_timestamp(s)) is not _fail:
+    return val
+
   if exact_match(r'[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]', s):
     return datetime.datetime.fromisoformat(s).replace(tzinfo=datetime.timezone.utc)
 
@@ -107,32 +181,157 @@ def parse_timestamp(s):
         (Z) |
         ([-+][0-9][0-9]?(:[0-9][0-9])?)
       )?''', s):
-    ymd, hms, fs, z, tz, tzs = m.groups()
-
-    fs = fs.ljust(7, '0') if fs else ''
-
-    if tz:
-      if not tzs:
-        tz += ':00'
-    elif z:
-      tz = '+00:00'
-    else:
-      tz = ''
-
-    iso = zfill_digits(f"{ymd}T{hms}{fs}{tz}")
-    val = datetime.datetime.fromisoformat(iso)
-    if not val.tzinfo:
-      val = val.replace(tzinfo=datetime.timezone.utc)
-    return val
+    return timestamp_value(*m.groups())
 
   return _fail
 
+def timestamp_value(ymd, hms, fs, z, tz, tzs):
+  fs = fs.ljust(7, '0') if fs else ''
+
+  if tz:
+    if not tzs:
+      tz += ':00'
+  elif z:
+    tz = '+00:00'
+  else:
+    tz = ''
+
+  iso = zfill_digits(f"{ymd}T{hms}{fs}{tz}")
+  val = datetime.datetime.fromisoformat(iso)
+  if not val.tzinfo:
+    val = val.replace(tzinfo=datetime.timezone.utc)
+  return val
+
 def parse_str(s):
   return s
 
+# Chars of the scalar decoded per step, so the whitespace-free copy of a chunk stays small whatever the scalar size
+BINARY_CHUNK = 1 << 16
+BASE64_DATA = re.compile(r'[A-Za-z0-9+/]*')
+BASE64_PADDING = re.compile(r'(?:=\s*)+')
+
+def decode_binary(s, as_memoryview=False):
+  """Base64 s ignoring whitespace, decoded a chunk at a time into one preallocated bytearray, or a memoryview of it.
+  Raises binascii.Error for a char outside the alphabet or bad padding, like b64decode(validate=True)."""
+  end = s.find('=')
+  if end == -1:
+    end = len(s)
+  elif not BASE64_PADDING.fullmatch(s, end):
+    raise binascii.Error('Non-base64 digit found')
+  padding = s.count('=', end)
+
+  buf = bytearray(end // 4 * 3 + 3)
+  n = 0
+  carry = ''
+  for i in range(0, end, BINARY_CHUNK):
+    data = carry + ''.join(s[i:min(i + BINARY_CHUNK, end)].split())
+    if not BASE64_DATA.fullmatch(data):
+      raise binascii.Error('Non-base64 digit found')
+    # The last whole quad is held back with any partial one, so the padding is checked against it at the end
+    whole = (len(data) - 1) // 4 * 4 if len(data) > 4 else 0
+    decoded = binascii.a2b_base64(data[:whole])
+    buf[n:n + len(decoded)] = decoded
+    n += len(decoded)
+    carry = data[whole:]
+
+  decoded = base64.b64decode(carry + '=' * padding, validate=True)
+  buf[n:n + len(decoded)] = decoded
+  n += len(decoded)
+  del buf[n:]
+  return memoryview(buf) if as_memoryview else buf
+
 def parse_binary(s):
-  return base64.b64decode(re.sub(r'\s', '', s), validate=True)
+  return bytes(decode_binary(s))
+
 
+# The patterns of parse_bool to parse_timestamp as one alternation in the order node_value() tries them, so the
+# first group to match is the type of the scalar. Each parse_* that strips a sign has it as (?P<..._sign>).
+SCALAR = re.compile(r'''^(?:
+  (?P<true>y|Y|yes|Yes|YES|true|True|TRUE|on|On|ON)
+| (?P<false>n|N|no|No|NO|false|False|FALSE|off|Off|OFF)
+| (?P<null>~|null|Null|NULL|)
+| (?P<int>(?P<int_sign>[-+]?)(?:
+    (?P<int2>0b[0-1_]+)
+  | (?P<int8>0[0-7_]+)
+  | (?P<int10>0|[1-9][0-9_]*)
+  | (?P<int16>0x[0-9a-fA-F_]+)
+  | (?P<int60>[1-9][0-9_]*:[0-5]?[0-9])))
+| (?P<nan>\.(?:nan|NaN|NAN))
+| (?P<float>(?P<float_sign>[-+]?)(?:
+    (?P<inf>\.(?:inf|Inf|INF))
+  | (?P<float10>(?:[0-9][0-9_]*)?\.[0-9_]*(?:[eE][-+][0-9]+)?)
+  | (?P<float60>[0-9][0-9_]*(?::[0-5]?[0-9])+\.[0-9_]*)))
+| (?P<date>[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9])
+| (?P<timestamp>
+    (?P<ymd>[0-9][0-9][0-9][0-9]-[0-9][0-9]?-[0-9][0-9]?)
+    (?:[Tt]|[\ \t]+)
+    (?P<hms>[0-9][0-9]?:[0-9][0-9]:[0-9][0-9])
+    (?P<fs>\.[0-9]*)?
+    [\ \t]*
+    (?:(?P<z>Z)|(?P<tz>[-+][0-9][0-9]?(?P<tzs>:[0-9][0-9])?))?)
+)$''', re.VERBOSE)
+
+# Every scalar that isn't a str starts with one of these, or is empty. $ also matches before a final newline,
+# so '\n' is null like ''
+SCALAR_STARTS = frozenset('yYnNtTfFoO~+-.0123456789\n')
+
+def classify(s):
+  """Same as trying each of parse_bool to parse_str in turn, but with one match of SCALAR"""
+  if s and s[0] not in SCALAR_STARTS:
+    return s
+  # Plain numbers and canonical timestamps can't match an earlier type, so they're converted without a regex
+  if plain_int(s):
+    return int(s)
+  if plain_float(s):
+    return float(s)
+  if s[:1].isdigit() and (val := canonical_timestamp(s)) is not _fail:
+    return val
+  if not (m := SCALAR.match(s)):
+    return s
+
+  kind = m.lastgroup
+  if kind == 'true':
+    return True
+  if kind == 'false':
+    return False
+  if kind == 'null':
+    return None
+  if kind == 'int':
+    mult = -1 if m['int_sign'] == '-' else 1
+    if m['int2']:
+      return mult * int(m['int2'][2:].replace('_', ''), 2)
+    if m['int8']:
+      return mult * int(m['int8'][1:].replace('_', ''), 8)
+    if m['int10']:
+      return mult * int(m['int10'].replace('_', ''), 10)
+    if m['int16']:
+      return mult * int(m['int16'][2:].replace('_', ''), 16)
+    return sexagesimal_int(s[len(m['int_sign']):])
+  if kind == 'nan':
+    return math.nan
+  if kind == 'float':
+    mult = -1 if m['float_sign'] == '-' else 1
+    body = s[len(m['float_sign']):]
+    if m['inf']:
+      return mult * math.inf
+    if m['float10']:
+      if body == '.':
+        # parse_float fails on a lone '.', leaving it to the types after float
+        return sequential_value(s, 'timestamp')
+      return mult * float(body.replace('_', ''))
+    return sexagesimal_float(body)
+  if kind == 'date':
+    return datetime.datetime.fromisoformat(s).replace(tzinfo=datetime.timezone.utc)
+  return timestamp_value(*m.group('ymd', 'hms', 'fs', 'z', 'tz', 'tzs'))
+
+SCHEMAS = 'bool null int float timestamp str binary'.split()
+
+def sequential_value(s, first='bool'):
+  for schema in SCHEMAS[SCHEMAS.index(first):]:
+    if (val := globals()['parse_' + schema](s)) is not _fail:
+      return val
+
+  raise ValueError('no types parse', s)
 
 def node_value(s, schema=None):
   if not isinstance(s, str):
@@ -148,8 +347,35 @@ def node_value(s, schema=None):
     return val
 
   # MAYBE implement merge value yaml
-  for schema in 'bool null int float timestamp str binary'.split():
-    if (val := globals()['parse_' + schema](s)) is not _fail:
-      return val
+  return classify(s)
 
-  raise ValueError('no types parse', s)
+def typed_column(values, typecode, use_numpy):
+  """values in an array of typecode 'q' or 'd', or a NumPy array if asked and installed; None if ints overflow"""
+  try:
+    column = array(typecode, values)
+  except OverflowError:
+    return None
+  if use_numpy and numpy is not None:
+    return numpy.frombuffer(column, dtype=numpy.int64 if typecode == 'q' else numpy.float64).copy()
+  return column
+
+def node_values(strings, schema=None, use_numpy=False):
+  """node_value() of each of strings. If every value is an int (that fits in 64 bits) or every value is a float,
+  they're returned as an array('q') or array('d'), or a NumPy array with use_numpy when NumPy is installed.
+  Otherwise, including for an empty input, they're a list."""
+  strings = list(strings)
+  if strings and schema in (None, 'int', 'float') and all(type(s) is str for s in strings):
+    # Plain numbers convert with int() or float() to the same value node_value() would
+    if schema != 'float' and all(map(plain_int, strings)):
+      if (column := typed_column(map(int, strings), 'q', use_numpy)) is not None:
+        return column
+    if schema != 'int' and all(map(plain_float, strings)):
+      return typed_column(map(float, strings), 'd', use_numpy)
+
+  values = [node_value(s, schema) for s in strings]
+  if values and all(type(v) is int for v in values):
+    if (column := typed_column(values, 'q', use_numpy)) is not None:
+      return column
+  elif values and all(type(v) is float for v in values):
+    return typed_column(values, 'd', use_numpy)
+  return values
@@ -0,0 +1,250 @@
+import weakref
+from array import array
+
+from lib import ParseResult
+
+
+# Fewest nodes and items a SpanTree holds before add_rule first compacts it
+COMPACT_MIN = 1 << 16
+
+
+class SpanTree:
+  """A show_parse value stored as parallel arrays instead of nested ParseResult objects
+
+  Node k is a ParseResult when rule[k] >= 0 (an index into names), or a tuple when rule[k] == -1.
+  Its children are items[first_item[k]:first_item[k] + item_count[k]]: a ParseResult has exactly one, its expr.
+  An item >= 0 is a node index, and an item < 0 is ~atom index of a str or None in atoms.
+  parent[k] is -1 for the node at the root.
+  """
+  # Set on a tree that Lib(span_tree=True) parses into: the SpanNode values still held outside it
+  handles = None
+
+  def __init__(self):
+    self.names = []
+    self.name_ids = {}
+    self.atoms = []
+    self.atom_ids = {}
+
+    self.rule = array('i')
+    self.start = array('i')
+    self.end = array('i')
+    self.parent = array('i')
+    self.first_item = array('i')
+    self.item_count = array('i')
+    self.items = array('i')
+    self.root = 0
+
+  @classmethod
+  def from_value(cls, value, source=None):
+    """The tree of a show_parse value. Where value holds SpanNode values of source (as parsing with
+    Lib(span_tree=True) builds), they're copied with everything under them, so only the nodes value reaches are kept."""
+    tree = cls()
+    tree.root = tree.add(value, -1, source)
+    return tree
+
+  def __len__(self):
+    return len(self.rule)
+
+  def columns(self):
+    arrays = self.rule, self.start, self.end, self.parent, self.first_item, self.item_count, self.items
+    return (self.root, tuple(self.names), tuple(self.atoms), *(a.tobytes() for a in arrays))
+
+  def __eq__(self, other):
+    # Trees of equal values are built in the same order, so they have equal columns
+    return isinstance(other, SpanTree) and self.columns() == other.columns()
+
+  def __hash__(self):
+    return hash(self.columns())
+
+  @property
+  def nbytes(self):
+    arrays = self.rule, self.start, self.end, self.parent, self.first_item, self.item_count, self.items
+    return sum(a.itemsize * len(a) for a in arrays)
+
+  def intern(self, table, ids, value):
+    if (i := ids.get(value)) is None:
+      i = ids[value] = len(table)
+      table.append(value)
+    return i
+
+  def add(self, value, parent, source=None, tuples=None):
+    """Append value and everything under it without recursing, returning its item. A SpanNode in value is a node
+    of source, copied with everything under it, or without a source, a node already in this tree. tuples maps the
+    id of a tuple already added to (tuple, node), so the node is shared instead of copied again."""
+    root = []
+    stack = [(value, parent, root, 0)]
+    while stack:
+      value, parent, slots, slot = stack.pop()
+      match value:
+        case SpanNode() if source is None:
+          k = value.index
+        case SpanNode(index=index) | int(index):
+          rule, first, count = source.rule[index], source.first_item[index], source.item_count[index]
+          if rule >= 0:
+            rule = self.intern(self.names, self.name_ids, source.names[rule])
+          k = self.new_node(rule, source.start[index], source.end[index], parent, count)
+          children = source.items[first:first + count]
+          stack.extend((c if c >= 0 else source.atoms[~c], k, self.items, self.first_item[k] + j)
+                       for j, c in reversed(list(enumerate(children))))
+        case ParseResult(name, start, end, expr):
+          k = self.new_node(self.intern(self.names, self.name_ids, name), start, end, parent, 1)
+          stack.append((expr, k, self.items, self.first_item[k]))
+        case tuple() if tuples is not None and id(value) in tuples:
+          k = tuples[id(value)][1]
+        case tuple():
+          k = self.new_node(-1, -1, -1, parent, len(value))
+          first = self.first_item[k]
+          stack.extend((v, k, self.items, first + j) for j, v in reversed(list(enumerate(value))))
+          if tuples is not None:
+            tuples[id(value)] = value, k
+        case str() | None:
+          k = ~self.intern(self.atoms, self.atom_ids, value)
+        case _:
+          raise ValueError('not a parse value', value)
+
+      if slots is root:
+        root.append(k)
+      else:
+        slots[slot] = k
+    return root[0]
+
+  def add_rule(self, name, start, end, expr):
+    """Append a node for rule name matching expr from start to end, and return it. Lib(span_tree=True) parses with
+    this instead of ParseResult, so a rule's value is its node and the value it matched is only kept here."""
+    if self.handles is None:
+      self.handles = weakref.WeakSet()
+      self.tuples = {}
+      self.compact_at = COMPACT_MIN
+    elif len(self.rule) + len(self.items) >= self.compact_at:
+      self.compact()
+    k = self.new_node(self.intern(self.names, self.name_ids, name), start, end, -1, 1)
+    self.items[self.first_item[k]] = self.add(expr, k, tuples=self.tuples)
+    node = SpanNode(k)
+    self.handles.add(node)
+    return node
+
+  def compact(self):
+    """Drop the nodes no SpanNode still reaches, renumbering the rest and the handles in place.
+
+    Backtracking discards matched rules, which with ParseResult values the garbage collector reclaims. Here their
+    nodes stay in the arrays, so they're swept once the arrays grow by half from their size after the last sweep."""
+    # Holding on to the tuples would keep their handles, and so their nodes, alive
+    self.tuples.clear()
+    rule, start, end, first_item, item_count, items = (
+      self.rule, self.start, self.end, self.first_item, self.item_count, self.items)
+    self.rule, self.start, self.end, self.parent, self.first_item, self.item_count, self.items = (
+      array('i') for _ in range(7))
+
+    moved = array('i', [-1]) * len(rule)
+    for handle in list(self.handles):
+      stack = [handle.index]
+      while stack:
+        k = stack[-1]
+        if moved[k] >= 0:
+          stack.pop()
+          continue
+        first = first_item[k]
+        children = items[first:first + item_count[k]]
+        pending = [c for c in children if c >= 0 and moved[c] < 0]
+        if pending:
+          stack.extend(pending)
+          continue
+        stack.pop()
+        moved[k] = self.new_node(rule[k], start[k], end[k], -1, len(children))
+        first = self.first_item[moved[k]]
+        self.items[first:first + len(children)] = array('i', (moved[c] if c >= 0 else c for c in children))
+      handle.index = moved[handle.index]
+    self.compact_at = max(3 * (len(self.rule) + len(self.items)) // 2, COMPACT_MIN)
+
+  def new_node(self, rule, start, end, parent, count):
+    self.rule.append(rule)
+    self.start.append(start)
+    self.end.append(end)
+    self.parent.append(parent)
+    self.first_item.append(len(self.items))
+    self.item_count.append(count)
+    self.items.extend([0] * count)
+    return len(self.rule) - 1
+
+  def item_view(self, item):
+    """A SpanView for a node item, else the atom itself"""
+    return SpanView(self, item) if item >= 0 else self.atoms[~item]
+
+  def view(self):
+    return self.item_view(self.root)
+
+  def materialize(self, item=None):
+    """Rebuild the original value of item (default the root) without recursing"""
+    item = self.root if item is None else item
+    if item < 0:
+      return self.atoms[~item]
+
+    built = {}
+    stack = [item]
+    while stack:
+      k = stack[-1]
+      first = self.first_item[k]
+      children = self.items[first:first + self.item_count[k]]
+      pending = [c for c in children if c >= 0 and c not in built]
+      if pending:
+        stack.extend(pending)
+        continue
+      stack.pop()
+      values = tuple(built.pop(c) if c >= 0 else self.atoms[~c] for c in children)
+      if self.rule[k] >= 0:
+        built[k] = ParseResult(self.names[self.rule[k]], self.start[k], self.end[k], values[0])
+      else:
+        built[k] = values
+    return built[item]
+
+
+class SpanNode:
+  """The value of a rule matched while parsing into a SpanTree: its node, renumbered when the tree compacts"""
+  __slots__ = 'index', '__weakref__'
+
+  def __init__(self, index):
+    self.index = index
+
+  def __repr__(self):
+    return f'SpanNode({self.index})'
+
+
+class SpanView:
+  """Lightweight handle on one node of a SpanTree; only materialize() builds ParseResult objects"""
+  __slots__ = 'tree', 'index'
+
+  def __init__(self, tree, index):
+    self.tree = tree
+    self.index = index
+
+  def __eq__(self, other):
+    return isinstance(other, SpanView) and (self.tree, self.index) == (other.tree, other.index)
+
+  def __repr__(self):
+    return f'SpanView({self.name}, {self.start}, {self.end})'
+
+  @property
+  def name(self):
+    rule = self.tree.rule[self.index]
+    return self.tree.names[rule] if rule >= 0 else None
+
+  @property
+  def start(self):
+    return self.tree.start[self.index]
+
+  @property
+  def end(self):
+    return self.tree.end[self.index]
+
+  @property
+  def parent(self):
+    parent = self.tree.parent[self.index]
+    return SpanView(self.tree, parent) if parent >= 0 else None
+
+  @property
+  def children(self):
+    first = self.tree.first_item[self.index]
+    return [self.tree.item_view(c) for c in self.tree.items[first:first + self.tree.item_count[self.index]]]
+
+  def materialize(self):
+    return self.tree.materialize(self.index)
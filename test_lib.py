@@ -6,9 +6,17 @@
       pytest test_lib.py
 """
 
+import collections
 import lib
+import itertools
 import math
+import os
 import pytest
+import sys
+import threading
+import time
+
+from concurrent.futures.process import BrokenProcessPool
 
 library = lib.Lib()
 
@@ -107,9 +115,29 @@ def test_diff():
     library.parse('5', diff)
   assert 'no results' in str(e_info.value)
 
-# def test_plain_node():
-#   assert library.parse('1.2', ("rule", "ns-plain", '0', 'FLOW-KEY')) == '1.2'
-# TODO implement lookbehind
+def test_lookaround():
+  assert library.parse('ab', ('concat', 'a', ('?=', 'b'), 'b')) == 'ab'
+  assert library.parse('ab', ('concat', 'a', ('?<=', 'a'), 'b')) == 'ab'
+  assert library.parse('ab', ('concat', 'a', ('?!', 'a'), 'b')) == 'ab'
+  assert library.parse('abc', ('concat', 'ab', ('?<=', ('concat', 'a', 'b')), ('?!', ('concat', 'c', 'd')), 'c')) == 'abc'
+
+  for expr in [('?=', 'a'), ('?<=', 'b'), ('?!', 'b'), ('?<=', ('concat', 'b', 'b'))]:
+    with pytest.raises(ValueError) as e_info:
+      library.parse('ab', ('concat', 'a', expr, 'b'))
+    assert 'no results' in str(e_info.value)
+
+def test_char_class():
+  flow_in = (None, None, lib.ENUM_IDS['FLOW-IN'], None)
+  safe_in = library.char_class(("rule", "ns-plain-safe", "c"), flow_in)
+  assert [bool(safe_in.allows(c, 0)) for c in 'a,é '] == [True, False, True, False]
+  assert library.char_class(("rule", "l-comment"), lib.EMPTY_FRAME) is None
+  assert library.char_class(("concat", "a", "b"), lib.EMPTY_FRAME) is None
+
+def test_plain_node():
+  assert library.parse('1.2', ("rule", "ns-plain", '0', 'FLOW-KEY')) == ('1', (None, '.'), None, '2')
+  assert library.recognize('a:b#c', ("rule", "ns-plain", '0', 'FLOW-OUT'))
+  for text in ['a #b', 'x: y', '- a', 'a:']:
+    assert not library.recognize(text, ("rule", "ns-plain", '0', 'FLOW-OUT')), text
 
 tree_lib = lib.Lib(show_parse=True)
 from lib import ParseResult as P
@@ -135,3 +163,474 @@ def test_tree_concat_many_rules():
     (P('c-non-specific-tag', 0, 1, '!'), P('c-tag', 1, 2, '!')),
     (P('c-non-specific-tag', 0, 1, '!'), P('c-non-specific-tag', 1, 2, '!')),
   }
+
+memo_lib = lib.Lib(memo_size=1000)
+
+def test_memo_same_results():
+  opts = {("rule", "c-non-specific-tag"), ("rule", "c-tag")}
+  expr = ('concat', opts, opts, opts)
+  assert memo_lib.parse('!!!', expr) == library.parse('!!!', expr)
+  assert memo_lib.parse('x2A', ("rule", "ns-esc-8-bit")) == 'x2A'
+
+def test_memo_counters():
+  l = lib.Lib(memo_size=1000)
+  opts = frozenset({("rule", "c-non-specific-tag"), ("rule", "c-tag")})
+  l.parse('!!', ('concat', opts, opts))
+  # opts at position 1 is resolved once for each way of matching position 0
+  assert l.memo_hits == 1
+  assert l.memo_misses > 1
+
+def test_memo_lazy():
+  l = lib.Lib(memo_size=1000)
+  l.text = 'aa'
+  expr = frozenset({'a', ('concat', 'a', 'a')})
+  first = l.resolve(0, expr, lib.EMPTY_FRAME)
+  head = next(first)
+  # Only what was consumed is resolved so far, and a second caller picks up from there
+  [(_, results, _)] = l.memo.values()
+  assert results == [head]
+  assert sorted(l.resolve(0, expr, lib.EMPTY_FRAME)) == [('a', 1), ('aa', 2)]
+  assert sorted([head, *first]) == [('a', 1), ('aa', 2)]
+  assert (l.memo_hits, l.memo_misses) == (1, 1)
+
+def test_memo_eviction():
+  l = lib.Lib(memo_size=2)
+  assert l.parse('[x]', ('concat', '[', {('rule', 'ns-hex-digit'), 'x'}, ']')) == '[x]'
+  assert len(l.memo) <= 2
+
+@pytest.mark.parametrize("engine", ['compiled', 'stack', 'chart'])
+def test_memo_other_engines(engine):
+  with pytest.raises(ValueError):
+    lib.Lib(memo_size=1000, engine=engine)
+
+parity_cases = [
+  ('c', 'c'),
+  ('a3z', ('concat', 'a', range(0x30, 0x3A), 'z')),
+  ('', ('concat',)),
+  ('0', {'0', '9'}),
+  ('aaa', ("repeat", 0, math.inf, "a")),
+  ('aaaa', ("repeat", 4, 4, "a")),
+  ('b', {'b', ("repeat", 1, math.inf, "a")}),
+  ('aa', ("repeat", 0, 3, ("repeat", 0, 1, "a"))),
+  ('aab', ("concat", ("repeat", 1, math.inf, {"a", ("repeat", 0, 1, "a")}), "b")),
+  ('x2A', ("rule", "ns-esc-8-bit")),
+  ('  ', ("rule", "s-indent", "2")),
+  ('  ', ("rule", "s-indent", "1")),
+  ('+', ("rule", "c-chomping-indicator", 'STRIP')),
+  ('\n', ('concat', ("^",), '\n', ("^",))),
+  ('a', ('concat', 'a', ("$",))),
+  ('1', ("diff", range(0x20, 0x7F), "0", range(0x35, 0x3A))),
+  ('5', ("diff", range(0x20, 0x7F), "0", range(0x35, 0x3A))),
+  ('!!', ('concat', {("rule", "c-non-specific-tag"), ("rule", "c-tag")}, {("rule", "c-non-specific-tag"), ("rule", "c-tag")})),
+  ('#a\n', ("rule", "l-comment")),
+  ('"a b"', ("rule", "c-double-quoted", "0", "FLOW-OUT")),
+  ('[ "a" ]', ("rule", "c-flow-sequence", "0", "FLOW-OUT")),
+  ('---', ("rule", "c-directives-end")),
+  ('ab', ('concat', 'a', ('?<=', ('concat', 'a')), ('?!', 'a'), 'b')),
+  ('1.2', ("rule", "ns-plain", '0', 'FLOW-KEY')),
+  ('a#b: c', ("rule", "ns-plain", '0', 'FLOW-OUT')),
+  ('- -x', ("rule", "l+block-sequence", '-1')),
+]
+
+def parse_or_error(l, text, expr):
+  try:
+    return l.parse(text, expr)
+  except ValueError as e:
+    return e.args
+
+engine_libs = {}
+
+def engine_lib(engine, show_parse):
+  key = engine, show_parse
+  if key not in engine_libs:
+    engine_libs[key] = lib.Lib(engine=engine, show_parse=show_parse)
+  return engine_libs[key]
+
+@pytest.mark.parametrize("engine", ['compiled', 'stack', 'chart'])
+@pytest.mark.parametrize("show_parse", [False, True])
+@pytest.mark.parametrize("text,expr", parity_cases)
+def test_engine_parity(engine, show_parse, text, expr):
+  expected = parse_or_error(engine_lib('tuple', show_parse), text, expr)
+  assert parse_or_error(engine_lib(engine, show_parse), text, expr) == expected
+
+def test_unknown_engine():
+  with pytest.raises(ValueError):
+    lib.Lib(engine='magic')
+
+def test_grammar_cache(tmp_path, monkeypatch):
+  monkeypatch.setattr(lib.Lib, 'cache_dir', tmp_path)
+  cold = lib.Lib()
+  assert len(list(tmp_path.glob('productions.*.pickle'))) == 1
+
+  monkeypatch.setattr(lib, 'Bnf', None)  # a cache hit never parses rule text
+  warm = lib.Lib()
+  assert warm.bnf == cold.bnf
+  assert warm.grammar_version == cold.grammar_version
+
+def test_grammar_cache_stale(tmp_path, monkeypatch):
+  monkeypatch.setattr(lib.Lib, 'cache_dir', tmp_path)
+  lib.Lib()
+  monkeypatch.setattr(lib, 'LIB_VERSION', lib.LIB_VERSION + 1)
+  assert lib.Lib().bnf == library.bnf
+  assert len(list(tmp_path.glob('productions.*.pickle'))) == 2
+
+def test_first_sets():
+  hex_digit = library.rule_firsts['ns-hex-digit']
+  assert [hex_digit.allows(c, 0) for c in '7aFg'] == [True, True, True, False]
+  assert not hex_digit.allows('', 0)
+
+  assert library.rule_firsts['c-tag'] == lib.First({'!'})
+  assert library.rule_firsts['s-indent'].nullable
+
+def test_first_set_expr():
+  first = lib.first_set(('concat', ('repeat', 0, 1, 'a'), {'b', range(0x30, 0x3A)}), {})
+  assert first == lib.First({'a', 'b'}, {range(0x30, 0x3A)})
+  assert lib.first_set(('concat', ('^',), ('repeat', 0, math.inf, 'a')), {}).nullable
+
+def test_interval_helpers():
+  assert lib.union_intervals([(0, 3)], [(2, 5), (7, 8)]) == [(0, 5), (7, 8)]
+  assert lib.subtract_intervals([(0, 10)], [(2, 3), (5, 7)]) == [(0, 2), (3, 5), (7, 10)]
+  assert lib.subtract_intervals([(0, 10)], [(0, 10)]) == []
+
+def test_terminals_found():
+  for name in 'c-printable nb-json ns-char ns-hex-digit c-indicator ns-uri-char ns-word-char c-nb-comment-text'.split():
+    assert library.terminals[name], name
+  assert library.terminals['l-comment'] is None
+  assert 's-indent' not in library.terminals or library.terminals['s-indent'] is None
+
+def test_construct_lazily():
+  l = lib.Lib()
+  # Terminals and rule variables are only worked out for the rules a parse reaches
+  assert not l.terminals and not l.def_vars
+  l.parse('x2A', ("rule", "ns-esc-8-bit"))
+  assert 'ns-hex-digit' in l.terminals and 'l-comment' not in l.terminals
+
+no_terminals_lib = lib.Lib()
+no_terminals_lib.terminals = collections.defaultdict(lambda: None)
+
+@pytest.mark.parametrize("text,expr", [
+  ('\t', ("rule", "c-printable")),
+  ('￾', ("rule", "c-printable")),
+  ('\U0001F600', ("rule", "nb-json")),
+  (' ', ("rule", "ns-char")),
+  ('%2F', ("rule", "ns-uri-char")),
+  ('%2F', ("repeat", 0, math.inf, ("rule", "ns-uri-char"))),
+  ('#abc', ("rule", "c-nb-comment-text")),
+  ('#', ("rule", "c-nb-comment-text")),
+  ('\\x41', ("rule", "c-ns-esc-char")),
+  ('!e!foo', ("rule", "c-ns-shorthand-tag")),
+  ('abc', ("repeat", 0, math.inf, ("rule", "ns-word-char"))),
+  ('a b', ("concat", ("rule", "nb-char"), ("repeat", 0, 2, ("rule", "ns-char")), ("rule", "s-white"), "b")),
+])
+def test_terminal_parity(text, expr):
+  assert parse_or_error(library, text, expr) == parse_or_error(no_terminals_lib, text, expr)
+
+stream = '''%YAML 1.2
+---
+a
+...
+# comment
+--- b
+--- c
+...
+...
+d
+'''
+
+def test_split_documents():
+  assert list(lib.split_documents(stream.splitlines(keepends=True))) == [
+    '%YAML 1.2\n---\na\n...\n',
+    '# comment\n--- b\n',
+    '--- c\n...\n',
+    '...\nd\n',
+  ]
+  assert list(lib.split_documents(['# only comments\n', '\n'])) == []
+  assert list(lib.split_documents(['---'])) == ['---']
+
+  # Spec Example 9.5, where "%!PS-Adobe-2.0" is the content of the literal
+  example = '%YAML 1.2\n--- |\n%!PS-Adobe-2.0\n...\n%YAML 1.2\n---\n# Empty\n...\n'
+  docs = list(lib.split_documents(example.splitlines(keepends=True)))
+  assert docs == ['%YAML 1.2\n--- |\n%!PS-Adobe-2.0\n...\n', '%YAML 1.2\n---\n# Empty\n...\n']
+  for doc in docs:
+    library.parse(doc, ("rule", "l-yaml-stream"))
+
+def test_source_lines(tmp_path):
+  path = tmp_path / 'stream.yaml'
+  path.write_text(stream, newline='')
+  expected = stream.splitlines(keepends=True)
+  assert list(lib.source_lines(path)) == expected
+  # A str is text, as in parse(), not a path
+  assert list(lib.source_lines(stream)) == expected
+  with open(path, newline='') as f:
+    assert list(lib.source_lines(f)) == expected
+  assert list(lib.source_lines(stream[i:i + 7] for i in range(0, len(stream), 7))) == expected
+  assert list(lib.source_lines(['a\r', '\nb\u2028c\r', 'd'])) == ['a\r\n', 'b\u2028c\r', 'd']
+
+def test_iter_documents():
+  anything = ('repeat', 0, math.inf, ('rule', 'c-printable'))
+  assert next(iter(library.iter_documents([stream], anything))) == '%YAML 1.2\n---\na\n...\n'
+  assert list(library.iter_documents(['--- x\n--- y\n'], anything)) == ['--- x\n', '--- y\n']
+  assert list(library.iter_documents('--- x\n--- y\n', anything)) == ['--- x\n', '--- y\n']
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_parse_many(tmp_path, workers):
+  path = tmp_path / 'doc.yaml'
+  path.write_text('x2B', newline='')
+  sources = ['x2A', 'x2G', path] * 3
+  results = list(library.parse_many(sources, ("rule", "ns-esc-8-bit"), workers=workers, chunksize=2))
+  assert [r.index for r in results] == list(range(len(sources)))
+  assert [r.value for r in results] == ['x2A', None, 'x2B'] * 3
+  assert all(isinstance(r.error, ValueError) for r in results[1::3])
+
+  unordered = library.parse_many(sources, ("rule", "ns-esc-8-bit"), workers=workers, ordered=False)
+  assert sorted(unordered, key=lambda r: r.index)[2].value == 'x2B'
+
+def test_parse_many_without_fork(monkeypatch, tmp_path):
+  # macOS has fork too, but it isn't safe there once threads have started
+  monkeypatch.setattr(sys, 'platform', 'darwin')
+  assert lib.worker_context(library) == (None, (None, library.options))
+
+  path = tmp_path / 'doc.yaml'
+  path.write_text('x2B', newline='')
+  results = library.parse_many(['x2A', path], ("rule", "ns-esc-8-bit"), workers=2)
+  assert [r.value for r in results] == ['x2A', 'x2B']
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'), reason="workers don't see the patch")
+@pytest.mark.parametrize("ordered", [True, False])
+def test_parse_many_worker_failures(monkeypatch, ordered):
+  parse = lib.Lib.parse
+  def failing(self, text, expr, **kwargs):
+    if text == 'exit':
+      os._exit(1)
+    if text == 'unpicklable':
+      raise ValueError(lambda: None)
+    return parse(self, text, expr, **kwargs)
+  monkeypatch.setattr(lib.Lib, 'parse', failing)
+
+  sources = ['x2A', 'unpicklable', 'x2A', 'x2A']
+  results = sorted(library.parse_many(sources, ("rule", "ns-esc-8-bit"), workers=2, chunksize=2, ordered=ordered),
+                   key=lambda r: r.index)
+  assert [r.index for r in results] == [0, 1, 2, 3]
+  assert results[0].error is not None and results[0].error is results[1].error
+  assert [r.value for r in results[2:]] == ['x2A', 'x2A']
+
+  sources = ['x2A', 'exit'] + ['x2A'] * 6
+  results = sorted(library.parse_many(sources, ("rule", "ns-esc-8-bit"), workers=2, chunksize=1, ordered=ordered),
+                   key=lambda r: r.index)
+  assert [r.index for r in results] == list(range(len(sources)))
+  assert isinstance(results[1].error, BrokenProcessPool)
+  assert all((r.value == 'x2A') != isinstance(r.error, BrokenProcessPool) for r in results)
+
+def test_parse_many_reads_ahead():
+  taken = []
+  def sources():
+    for i in range(100):
+      taken.append(i)
+      yield 'x2A'
+  results = library.parse_many(sources(), ("rule", "ns-esc-8-bit"), workers=2, chunksize=2)
+  assert next(results).value == 'x2A'
+  assert len(taken) <= 2 * 2 * 2 + 2
+  assert sum(1 for _ in results) == 99
+
+@pytest.mark.parametrize("engine", lib.Lib.engines)
+def test_parse_limits(engine):
+  l = engine_lib(engine, False)
+  text = '[a, [b, c]]\n'
+  with pytest.raises(lib.ParseLimitExceeded) as e_info:
+    l.parse(text, ("rule", "l-yaml-stream"), max_steps=50)
+  e = e_info.value
+  assert (e.reason, e.steps) == ('max_steps', 51)
+  assert 0 <= e.farthest < len(text)
+  assert e.rule_stack[:3] == ['l-yaml-stream', 'l-any-document', 'l-bare-document']
+
+  cancel = threading.Event()
+  cancel.set()
+  with pytest.raises(lib.ParseLimitExceeded) as e_info:
+    l.parse(text, ("rule", "l-yaml-stream"), cancel=cancel)
+  assert e_info.value.reason == 'cancelled'
+  with pytest.raises(lib.ParseLimitExceeded) as e_info:
+    l.parse(text, ("rule", "l-yaml-stream"), deadline=time.monotonic() - 1)
+  assert e_info.value.reason == 'deadline'
+
+  # Limits only apply to the parse they're given to
+  assert l.parse(text, ("rule", "l-yaml-stream"), max_steps=10 ** 6) == l.parse(text, ("rule", "l-yaml-stream"))
+  assert 'rule_frames' not in vars(l)
+
+@pytest.mark.parametrize("engine", lib.Lib.engines)
+def test_parse_limit_stack(engine):
+  l = engine_lib(engine, False)
+  with pytest.raises(lib.ParseLimitExceeded) as e_info:
+    l.parse('#a\n', ("rule", "l-comment"), max_steps=1)
+  assert e_info.value.rule_stack == ['l-comment', 's-separate-in-line']
+
+  with pytest.raises(lib.ParseLimitExceeded) as e_info:
+    l.parse('  ', ("rule", "s-indent", "2"), max_steps=0)
+  assert e_info.value.rule_stack == ['s-indent(2)']
+
+def test_stack_engine_deep_input():
+  text = 'a' * (sys.getrecursionlimit() + 500)
+  assert engine_lib('stack', False).parse(text, ("repeat", 1, math.inf, "a")) == text
+
+def test_chart_engine_ambiguous():
+  # Every split of the a's into "a" and "aa" is a parse, which backtracking tries one at a time
+  expr = ("concat", ("repeat", 0, math.inf, frozenset({"a", ("concat", "a", "a")})), "b")
+  chart = engine_lib('chart', False)
+  with pytest.raises(ValueError):
+    chart.parse('a' * 400 + 'c', expr)
+  assert chart.parse('a' * 400 + 'b', expr) == 'a' * 400 + 'b'
+  assert parse_or_error(chart, 'aaab', expr) == parse_or_error(engine_lib('tuple', False), 'aaab', expr)
+
+def test_chart_engine_deep_input():
+  expected = engine_lib('tuple', False).parse(deep_block, ("rule", "l-yaml-stream"))
+  assert engine_lib('chart', False).parse(deep_block, ("rule", "l-yaml-stream")) == expected
+  # Deeper than resolve() can go, so only checked to parse
+  depth = sys.getrecursionlimit() // 4
+  text = '[' * depth + ']' * depth + '\n'
+  results = engine_lib('chart', True).parse(text, ("rule", "l-yaml-stream"))
+  assert len(results) == 3 and all(r.end == len(text) for r in results)
+
+def test_repeat_duplicate_matches():
+  # Each iteration matches 'a' two ways, which used to double the work per character
+  text = 'a' * 200
+  assert library.parse(text, ("repeat", 0, math.inf, frozenset({"a", ("concat", "a")}))) == text
+
+@pytest.mark.parametrize("engine", lib.Lib.engines)
+def test_parse_drops_tables(engine):
+  l = lib.Lib(engine=engine, memo_size=1000) if engine == 'tuple' else engine_lib(engine, False)
+  l.parse('a: b\n', ("rule", "l-yaml-stream"))
+  assert not (l.memo or l.ends_memo or l.matched or l.spans or l.suffixes)
+  with pytest.raises(ValueError):
+    l.parse('a: [\n', ("rule", "l-yaml-stream"))
+  assert not (l.memo or l.ends_memo or l.matched or l.spans or l.suffixes)
+
+@pytest.mark.parametrize("text,expr", parity_cases)
+def test_match_ends(text, expr):
+  ends = library.match_ends(text, 0, expr)
+  assert not (library.ends_memo or library.matched)
+  assert ends == {end for _, end in library.resolve(0, expr, lib.EMPTY_FRAME)}
+  assert library.recognize(text, expr) == (len(text) in ends)
+
+def test_recognize():
+  assert library.recognize('x2A', ("rule", "ns-esc-8-bit"))
+  assert not library.recognize('x2G', ("rule", "ns-esc-8-bit"))
+  assert library.match_ends('[ "a" ] ', 0, ("rule", "c-flow-sequence", "0", "FLOW-OUT")) == {7}
+  assert library.match_ends('  -', 0, ("repeat", 0, math.inf, ("rule", "s-white"))) == {0, 1, 2}
+
+deep_block = ''.join('  ' * i + 'k:\n' for i in range(30)) + '  ' * 30 + 'v\n'
+
+def test_recognize_deep_input():
+  assert library.recognize(deep_block, ("rule", "l-yaml-stream"))
+  depth = sys.getrecursionlimit() // 4
+  assert library.recognize('[' * depth + ']' * depth + '\n', ("rule", "l-yaml-stream"))
+  assert not library.recognize('[' * depth + ']' * (depth - 1) + '\n', ("rule", "l-yaml-stream"))
+
+def test_fold_values():
+  atoms = ['a', 'bc', '', None, P('r', 0, 1, 'a'), ('x', None), ('y',)]
+  for n in range(4):
+    for parts in itertools.product(atoms, repeat=n):
+      values, expected = None, None
+      for v in parts:
+        values = v, values, None
+      for v in reversed(parts):
+        expected = lib.str_concat(v, expected)
+      assert lib.fold_values(values) == expected, parts
+
+@pytest.mark.parametrize("engine", ['tuple', 'compiled', 'stack'])
+def test_repeat_values_linear(engine, monkeypatch):
+  folded = []
+  fold_values = lib.fold_values
+  def counting(values):
+    chain = values
+    while chain:
+      folded.append(chain[0])
+      chain = chain[1]
+    return fold_values(values)
+  monkeypatch.setattr(lib, 'fold_values', counting)
+
+  # Folding the values so far for each count of the repeat would fold n * n / 2 of them
+  expr = ('repeat', 0, math.inf, ('concat', ('repeat', 0, 1, ' '), 'a'))
+  expected = lib.Lib(engine='chart').parse('a' * 1000, expr)
+  folded.clear()
+  assert lib.Lib(engine=engine).parse('a' * 1000, expr) == expected
+  assert len(folded) <= 4 * 1000
+
+  folded.clear()
+  text = 'key: ' + ' '.join(f'w{i}' for i in range(300)) + '\n'
+  lib.Lib(engine=engine, show_parse=True).parse(text, ("rule", "l-yaml-stream"))
+  assert len(folded) <= 4 * len(text)
+
+def frame(**vars):
+  return tuple(vars.get(v) for v in lib.VARS)
+
+def test_binding_plan():
+  assert lib.binding_plan(['n', 'c'], ['n+1+m', 'FLOW-IN'])(frame(n=2, m=3)) == frame(n=6, c=lib.ENUM_IDS['FLOW-IN'])
+  assert lib.binding_plan(['n+1'], ['n'])(frame(n=2)) == frame(n=1)
+  assert lib.binding_plan(['n+1'], ['n'])(frame(n=0)) is None
+  assert lib.binding_plan(['n'], ['-1'])(frame()) == frame(n=-1)
+  assert lib.binding_plan(['n'], ['n-1'])(frame(n=0)) == frame(n=-1)
+  assert lib.binding_plan(['0'], ['n'])(frame(n=0)) == frame()
+  assert lib.binding_plan(['BLOCK-IN'], ['c'])(frame(c=lib.ENUM_IDS['BLOCK-OUT'])) is None
+  assert lib.binding_plan(['c'], ['in-flow(c'])(frame(c=lib.ENUM_IDS['BLOCK-KEY'])) == frame(c=lib.ENUM_IDS['FLOW-KEY'])
+
+def test_enter():
+  rule = ('rule', 'c-chomping-indicator', 'STRIP')
+  assert library.enter(rule, lib.EMPTY_FRAME) == [(0, lib.EMPTY_FRAME, [])]
+  assert library.enter(rule, lib.EMPTY_FRAME) is library.enter(rule, lib.EMPTY_FRAME)
+
+  # m is left unbound by the params, so it's inferred on entry
+  [(_, f, inferred)] = library.enter(('rule', 's-l+block-indented', '0', 'BLOCK-IN'), lib.EMPTY_FRAME)
+  assert f == frame(n=0, c=lib.ENUM_IDS['BLOCK-IN'])
+  assert [slot for slot, _ in inferred] == [lib.VAR_SLOTS['m']]
+
+def rule_frames(text, i, rule):
+  library.text = text
+  return [f for _, f in library.rule_frames(rule, lib.EMPTY_FRAME, i)]
+
+def test_rule_frames():
+  assert rule_frames('-   - a', 1, ('rule', 's-l+block-indented', '0', 'BLOCK-IN')) == \
+    [frame(n=0, m=3, c=lib.ENUM_IDS['BLOCK-IN'])]
+  assert rule_frames(' ' * 12 + 'a: b', 0, ('rule', 'l+block-mapping', '-1')) == [frame(n=-1, m=12)]
+  assert rule_frames(' ' * 12 + 'a: b', 0, ('rule', 'l+block-mapping', '12')) == []
+
+  literal = ('rule', 'c-l+literal', '1')
+  clip, keep, strip = (lib.ENUM_IDS[t] for t in ['CLIP', 'KEEP', 'STRIP'])
+  assert rule_frames('|\n\n  \n' + ' ' * 9 + 'x\n', 0, literal) == [frame(n=1, m=8, t=clip)]
+  assert rule_frames('|-\n  x', 0, literal) == [frame(n=1, m=1, t=strip)]
+  assert rule_frames('|3+ # c\n     x', 0, literal) == [frame(n=1, m=3, t=keep)]
+  assert rule_frames('|+3\n', 0, literal) == [frame(n=1, m=3, t=keep)]
+  assert rule_frames('|\n\n     \n', 0, literal) == [frame(n=1, m=4, t=clip)]
+
+@pytest.mark.parametrize("engine", ['tuple', 'compiled'])
+def test_profile(engine):
+  l = lib.Lib(engine=engine, profile=True)
+  assert l.parse('#a\n', ("rule", "l-comment")) == '#a\n'
+  stats = l.profile.rules
+  # parse() resumes each call once more looking for another match
+  comment = stats['l-comment']
+  assert comment == lib.RuleStats(1, 1, 0, comment.total, comment.self, 1)
+  assert comment.total >= comment.self
+  assert (stats['b-comment'].calls, stats['b-comment'].successes, stats['b-comment'].failures) == (3, 1, 2)
+  assert ('l-comment', 'b-comment', 'b-non-content') in l.profile.stacks
+
+  with pytest.raises(ValueError):
+    l.parse('  ', ("rule", "s-indent", "1"))
+  assert (stats['s-indent(1)'].successes, stats['s-indent(1)'].failures) == (1, 0)
+
+  assert l.profile.table().splitlines()[0].split()[0] == 'rule'
+  assert all(line.split()[0].split(';')[0] in ('l-comment', 's-indent(1)') for line in l.profile.collapsed().splitlines())
+  l.profile.clear()
+  assert not l.profile.rules
+
+def test_profile_off():
+  assert library.profile is None
+  assert 'resolve_expr' not in vars(library)
+  with pytest.raises(ValueError):
+    lib.Lib(engine='stack', profile=True)
+  with pytest.raises(ValueError):
+    lib.Lib(engine='chart', profile=True)
+
+def test_deep_block_scalar():
+  text = '|\n' + ' ' * 10 + 'abc\n'
+  expected = ('|', (None, None, '\n'), (None, *' ' * 10, 'a', 'b', 'c'), None, '\n')
+  for engine in lib.Lib.engines:
+    assert engine_lib(engine, False).parse(text, ('rule', 'c-l+literal', '-1')) == expected
@@ -6,10 +6,15 @@
       pytest test_node.py
 """
 
+import base64
+import itertools
 import math
+import node
 import pytest
+import re
 
 from datetime import datetime, timedelta, timezone
+from array import array
 from node import node_value as nv
 
 
@@ -133,4 +138,86 @@ def test_binary():
   assert nv('', 'binary') == b''
   with pytest.raises(ValueError):
     nv('~', 'binary')
+
+def test_decode_binary(monkeypatch):
+  view = node.decode_binary('SGVsbG8sIFd \n\tvcmxkIQ==', as_memoryview=True)
+  assert isinstance(view, memoryview)
+  assert view == b'Hello, World!'
+  assert node.decode_binary('') == bytearray()
+
+  # Chunks split quads, whitespace and the padding differently, but decode the same
+  monkeypatch.setattr(node, 'BINARY_CHUNK', 4)
+  for s in ['SGVsbG8sIFd \n\tvcmxkIQ==', 'SGVs\nbG8s\n', 'QQ=\n=', 'QUI= ', 'QUJD']:
+    assert outcome(node.parse_binary, s) == outcome(lambda s: base64.b64decode(re.sub(r'\s', '', s), validate=True), s)
+  for s in ['QQ=', 'QQ==QQ==', '=', 'QUJDR', 'QU~D', 'QQ=~']:
+    with pytest.raises(ValueError):
+      node.parse_binary(s)
 #cSpell:enable
+
+
+def outcome(f, s):
+  try:
+    v = f(s)
+  except ValueError:
+    return ValueError
+  return type(v), repr(v)
+
+@pytest.mark.parametrize("n", range(4))
+def test_classify_parity(n):
+  pieces = ['0', '1', '7', '9', 'b', 'x', 'f', '_', ':', '.', '-', '+', 'e', 'n', 'a', 'N', 'I', 'o', ' ', 'T', 'Z',
+            'true', 'Off', 'null', '~', '.nan', '.inf', '2001-02-03', '04:05:06', '\n']
+  for parts in itertools.product(pieces, repeat=n):
+    s = ''.join(parts)
+    assert outcome(node.classify, s) == outcome(node.sequential_value, s), s
+
+
+def test_node_values():
+  assert node.node_values(['1', '-2', '0x10', '1:1']) == array('q', [1, -2, 16, 61])
+  assert node.node_values(iter(['1', '-20'])) == array('q', [1, -20])
+  assert node.node_values(['1.5', '-.5', '.inf']) == array('d', [1.5, -0.5, math.inf])
+  assert node.node_values(['1', '2.5']) == [1, 2.5]
+  assert node.node_values(['1', 'a', None]) == [1, 'a', None]
+  assert node.node_values(['true', 'false']) == [True, False]
+  assert node.node_values([str(2 ** 63), '1']) == [2 ** 63, 1]
+  assert node.node_values([]) == []
+
+  assert node.node_values(['1', '2'], 'str') == ['1', '2']
+  assert node.node_values(['0', '1.0'], 'float') == array('d', [0.0, 1.0])
+  with pytest.raises(ValueError):
+    node.node_values(['10', '1.0'], 'float')
+
+@pytest.mark.parametrize("strings", [
+  ['0', '-0', '+12', '9' * 18], ['010', '0b11', '1_000'], ['1.', '-.5', '0.0', '+1.5e-3', '.5E+2'],
+  ['1.1e1', '2.'], ['.', '1.5'], ['1', '2\n'], ['0.1', '1_0.5'],
+])
+def test_node_values_parity(strings):
+  values = node.node_values(strings)
+  expected = [nv(s) for s in strings]
+  assert [(type(v), repr(v)) for v in values] == [(type(v), repr(v)) for v in expected]
+
+def test_node_values_numpy():
+  numpy = pytest.importorskip('numpy')
+  ints = node.node_values(['1', '2'], use_numpy=True)
+  assert ints.dtype == numpy.int64 and ints.tolist() == [1, 2]
+  assert node.node_values(['1.5'], use_numpy=True).dtype == numpy.float64
+
+
+fast_path_cases = [
+  f'2001-02-03{t}04:05:06{f}{z}' for t in 'Tt ' for f in ['', '.', '.1', '.123456', '.1234567']
+  for z in ['', 'Z', '+01:00', '-11:45', '-00:00', '+24:00', '+05:60', '+1', ' Z']
+] + [
+  '2001-02-03', '2001-13-03', '2001-02-30', '2001-2-03', '2001-02-03T24:00:00', '2001-02-03T23:59:60',
+  '0', '-0', '+7', '10', '010', '1_0', '99999999999999999999', '1.5', '-.5', '+2.', '.', '-.', '1.5e+3', '1.5E-03',
+  '1.5e3', '1e+1', '1.5\n', '١٢', '1.٢',
+]
+
+@pytest.mark.parametrize("s", fast_path_cases)
+def test_fast_path_parity(s, monkeypatch):
+  with monkeypatch.context() as m:
+    m.setattr(node, 'plain_int', lambda s: False)
+    m.setattr(node, 'plain_float', lambda s: False)
+    m.setattr(node, 'canonical_timestamp', lambda s: node._fail)
+    expected = outcome(node.sequential_value, s)
+  assert outcome(nv, s) == expected
+  assert outcome(node.sequential_value, s) == expected
+
@@ -0,0 +1,41 @@
+"""
+  Test cases for the web server's parse pool
+
+  Run tests with
+
+      pytest test_server.py
+"""
+
+import os
+import pytest
+import signal
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), 'web'))
+import server
+
+
+@pytest.fixture
+def service():
+  service = server.ParseService(workers=1)
+  yield service
+  service.pool.shutdown(cancel_futures=True)
+
+
+def test_parse(service):
+  result, success, cacheable = service.parse('a: b\n', ['l-yaml-stream'])
+  assert success and cacheable
+
+
+@pytest.mark.skipif(not hasattr(signal, 'SIGKILL'), reason="needs SIGKILL")
+def test_worker_killed(service):
+  broken = service.pool
+  os.kill(broken.submit(os.getpid).result(), signal.SIGKILL)
+  # Let the pool notice, so the next request is the one finding it broken
+  time.sleep(0.2)
+
+  result, success, cacheable = service.parse('a: b\n', ['l-yaml-stream'])
+  assert success and cacheable
+  assert service.pool is not broken
+  assert service.parse('a: b\n', ['l-yaml-stream'])[1]
@@ -0,0 +1,95 @@
+"""
+  Test cases for compact parse trees
+
+  Run tests with
+
+      pytest test_spans.py
+"""
+
+import lib
+import pytest
+import spans
+
+from lib import ParseResult as P
+from spans import SpanTree
+
+tree_lib = lib.Lib(show_parse=True)
+
+
+def test_round_trip():
+  value = tree_lib.parse('x2A', ("rule", "ns-esc-8-bit"))
+  tree = SpanTree.from_value(value)
+  assert tree.materialize() == value
+  assert len(tree) == 5
+  assert tree.names == ['ns-esc-8-bit', 'ns-hex-digit', 'ns-dec-digit']
+
+
+def test_view():
+  tree = SpanTree.from_value(tree_lib.parse('x2A', ("rule", "ns-esc-8-bit")))
+  root = tree.view()
+  assert (root.name, root.start, root.end) == ('ns-esc-8-bit', 0, 3)
+  assert root.parent is None
+
+  expr, = root.children
+  assert expr.name is None
+  x, two, a = expr.children
+  assert x == 'x'
+  assert (two.name, two.start, two.end) == ('ns-hex-digit', 1, 2)
+  assert two.parent == expr
+  assert a.materialize() == P('ns-hex-digit', 2, 3, 'A')
+
+
+def test_atoms():
+  tree = SpanTree.from_value(('a', None, P('r', 0, 1, 'a')))
+  assert tree.atoms == ['a', None]
+  assert tree.materialize() == ('a', None, P('r', 0, 1, 'a'))
+  assert SpanTree.from_value(None).view() is None
+
+
+def test_deep():
+  value = 'x'
+  for i in range(5000):
+    value = P('r', 0, 1, (value, 'y'))
+  tree = SpanTree.from_value(value)
+  assert len(tree) == 10000
+  # Comparing the values themselves would recurse, so compare the trees they flatten to
+  again = SpanTree.from_value(tree.materialize())
+  assert (again.rule, again.parent, again.items, again.atoms) == (tree.rule, tree.parent, tree.items, tree.atoms)
+
+
+def test_rejects_sets():
+  with pytest.raises(ValueError):
+    SpanTree.from_value({P('r', 0, 1, 'a'), P('s', 0, 1, 'a')})
+
+
+@pytest.mark.parametrize("engine", lib.Lib.engines)
+@pytest.mark.parametrize("text,expr", [
+  ('x2A', ("rule", "ns-esc-8-bit")),
+  ('- a\n- b: [c, "d"]\n', ("rule", "l-yaml-stream")),
+  ('[[]]\n', ("rule", "l-yaml-stream")),
+])
+def test_parse_span_tree(engine, text, expr):
+  value = lib.Lib(engine=engine, show_parse=True).parse(text, expr)
+  expected = {SpanTree.from_value(v) for v in value} if isinstance(value, set) else SpanTree.from_value(value)
+  assert lib.Lib(engine=engine, span_tree=True).parse(text, expr) == expected
+
+
+def test_parse_span_tree_keeps_reached_nodes():
+  span_lib = lib.Lib(span_tree=True)
+  tree = span_lib.parse('x2A', ("rule", "ns-esc-8-bit"))
+  assert tree.materialize() == tree_lib.parse('x2A', ("rule", "ns-esc-8-bit"))
+  assert len(tree) == 5
+  assert [v.parent for v in tree.view().children[0].children[1:]] == [tree.view().children[0]] * 2
+  assert span_lib.rule_value is lib.ParseResult
+
+
+@pytest.mark.parametrize("engine", lib.Lib.engines)
+def test_parse_span_tree_compacts(engine, monkeypatch):
+  text = '- a\n- b: [c, "d"]\n'
+  expected = SpanTree.from_value(lib.Lib(engine=engine, show_parse=True).parse(text, ("rule", "l-yaml-stream")))
+  compacted = []
+  compact = SpanTree.compact
+  monkeypatch.setattr(spans, 'COMPACT_MIN', 8)
+  monkeypatch.setattr(SpanTree, 'compact', lambda self: compacted.append(len(self)) or compact(self))
+  assert lib.Lib(engine=engine, span_tree=True).parse(text, ("rule", "l-yaml-stream")) == expected
+  assert compacted
@@ -7,13 +7,21 @@ class App extends React.Component {
   }
 
   clickRun = async () => {
+    const {rule, text} = this.state;
+    const headers = {
+      "Content-Type": "application/json",
+    };
+    // The result on screen is still current if the server says the response hasn't changed
+    if (this.lastRun && this.lastRun.etag && this.lastRun.rule === rule && this.lastRun.text === text) {
+      headers["If-None-Match"] = this.lastRun.etag;
+    }
     var request = await fetch("values", {
       method: "POST",
-      headers: {
-        "Content-Type": "application/json",
-      },
-      body: JSON.stringify(this.state),
+      headers,
+      body: JSON.stringify({rule, text}),
     });
+    if (request.status === 304) return;
+    this.lastRun = {rule, text, etag: request.headers.get("ETag")};
     // Don't use HTTP error code because you can't catch that using babel compiled code...?
     const {success, result} = await request.json();
     this.setState({success, result: success ? JSON.stringify(result, null, 2) : result});
@@ -1,26 +1,187 @@
 import dataclasses
+import hashlib
 import json
+import threading
+import time
 import traceback
-from http.server import HTTPServer, SimpleHTTPRequestHandler
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
 
 import os
 import sys
 print()
 sys.path.append(os.path.join(sys.path[0], '..'))
+import lib
 from lib import Lib
+from spans import SpanTree
 
 class DataClassJSONEncoder(json.JSONEncoder):
   def default(self, o):
+    if isinstance(o, SpanTree):
+      return o.materialize()
     if dataclasses.is_dataclass(o):
       return dataclasses.asdict(o)
     return super().default(o)
 
+def parse_rule(text, rule, timeout):
+  """Runs in a pool worker, on the Lib the pool was started with. Returns (result, success, cacheable)"""
+  try:
+    return lib.worker_lib.parse(text, ('rule', *rule), deadline=time.monotonic() + timeout), True, True
+  except lib.ParseLimitExceeded as e:
+    # Might finish on a less busy server, so not cached
+    return f'Gave up: {e}', False, False
+  except Exception as e:
+    return traceback.format_exc(), False, True
+
+class ResponseCache:
+  """LRU of encoded response bytes, evicting the least recently used until they fit in max_bytes"""
+
+  def __init__(self, max_bytes):
+    self.max_bytes = max_bytes
+    self.entries = OrderedDict()
+    self.bytes = 0
+    self.hits = 0
+    self.misses = 0
+    self.lock = threading.Lock()
+
+  def get(self, key):
+    with self.lock:
+      if (body := self.entries.get(key)) is None:
+        self.misses += 1
+        return None
+      self.entries.move_to_end(key)
+      self.hits += 1
+      return body
+
+  def put(self, key, body):
+    if len(body) > self.max_bytes:
+      return
+    with self.lock:
+      if (old := self.entries.pop(key, None)) is not None:
+        self.bytes -= len(old)
+      self.entries[key] = body
+      self.bytes += len(body)
+      while self.bytes > self.max_bytes:
+        _, evicted = self.entries.popitem(last=False)
+        self.bytes -= len(evicted)
+
+  def stats(self):
+    with self.lock:
+      return dict(entries=len(self.entries), bytes=self.bytes, max_bytes=self.max_bytes, hits=self.hits,
+                  misses=self.misses)
+
+class ParseService:
+  """Parses requests on a bounded pool of worker processes that share one loaded grammar, keeping latency stats.
+
+  On Linux, workers are forked from this process after the grammar is loaded, so none of them re-reads
+  productions.bnf; elsewhere each loads it from the grammar cache.
+  They parse into a SpanTree, so a result comes back as a few arrays instead of a pickle of nested ParseResults.
+  A worker dying breaks the whole pool, so it's replaced by a new one forked from the same Lib."""
+
+  def __init__(self, workers=None, recent=1000, cache_bytes=64 << 20, timeout=30):
+    self.workers = workers or os.cpu_count() or 1
+    self.timeout = timeout
+    shared = Lib(span_tree=True)
+    self.grammar_version = shared.grammar_version
+    self.cache = ResponseCache(cache_bytes)
+    self.context, self.initargs = lib.worker_context(shared)
+    self.pool = self.start_pool()
+    self.pool_lock = threading.Lock()
+
+    self.lock = threading.Lock()
+    self.in_flight = 0
+    self.requests = 0
+    self.total_seconds = 0.0
+    self.latencies = deque(maxlen=recent)
+
+  def start_pool(self):
+    pool = ProcessPoolExecutor(self.workers, mp_context=self.context, initializer=lib.init_worker,
+                               initargs=self.initargs)
+    # The pool only starts its workers on the first submit, which would otherwise fork in the middle of a parse
+    for started in [pool.submit(os.getpid) for _ in range(self.workers)]:
+      started.result()
+    return pool
+
+  def restart_pool(self, broken):
+    """Replaces broken with a new pool, unless another request already has"""
+    with self.pool_lock:
+      if self.pool is broken:
+        broken.shutdown(wait=False, cancel_futures=True)
+        self.pool = self.start_pool()
+
+  def submit(self, text, rule):
+    pool = self.pool
+    try:
+      return pool.submit(parse_rule, text, rule, self.timeout).result()
+    except BrokenProcessPool:
+      self.restart_pool(pool)
+      raise
+
+  def response_key(self, text, rule):
+    """Hash identifying the response to parsing text as rule, which is only ever different for another grammar"""
+    key = json.dumps([rule, text, self.grammar_version])
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+  def parse(self, text, rule):
+    """(result, success, cacheable), retrying once on a new pool if a worker died. Raises BrokenProcessPool if the
+    retry's worker died too, which is likely the text's fault."""
+    start = time.perf_counter()
+    with self.lock:
+      self.in_flight += 1
+    try:
+      try:
+        return self.submit(text, rule)
+      except BrokenProcessPool:
+        return self.submit(text, rule)
+    finally:
+      elapsed = time.perf_counter() - start
+      with self.lock:
+        self.in_flight -= 1
+        self.requests += 1
+        self.total_seconds += elapsed
+        self.latencies.append(elapsed)
+
+  def stats(self):
+    with self.lock:
+      recent = sorted(self.latencies)
+      def percentile(p):
+        return recent[min(int(len(recent) * p), len(recent) - 1)] * 1000 if recent else None
+      return dict(
+        workers=self.workers,
+        in_flight=self.in_flight,
+        queue_depth=max(self.in_flight - self.workers, 0),
+        requests=self.requests,
+        mean_ms=self.total_seconds / self.requests * 1000 if self.requests else None,
+        p50_ms=percentile(0.5),
+        p95_ms=percentile(0.95),
+        max_ms=recent[-1] * 1000 if recent else None,
+        cache=self.cache.stats(),
+      )
+
 class LibHandler(SimpleHTTPRequestHandler):
-  def __init__(self, lib, *args, **kwargs):
+  def __init__(self, service, *args, **kwargs):
     # https://stackoverflow.com/a/71399394/771768
-    self.lib = lib
+    self.service = service
     super().__init__(*args, **kwargs)
 
+  def send_json(self, response, etag=None, status=200):
+    body = response if isinstance(response, bytes) else json.dumps(response, cls=DataClassJSONEncoder).encode('utf-8')
+    self.send_response(status)
+    self.send_header('Content-type', 'application/json')
+    if etag:
+      self.send_header('ETag', etag)
+    self.end_headers()
+    self.wfile.write(body)
+
+  def do_GET(self):
+    if self.path == '/stats':
+      self.send_json(self.service.stats())
+    else:
+      super().do_GET()
+
   def do_POST(self):
     length = int(self.headers.get('content-length'))
     body = json.loads(self.rfile.read(length))
@@ -28,25 +189,44 @@ class LibHandler(SimpleHTTPRequestHandler):
     rule = body['rule'].strip(')').replace('(', ' ').replace(',', ' ').split()
     print(rule, text)
 
+    key = self.service.response_key(text, rule)
+    etag = f'"{key[:32]}"'
+    if self.headers.get('If-None-Match') == etag:
+      self.send_response(304)
+      self.send_header('ETag', etag)
+      self.end_headers()
+      return
+    if body := self.service.cache.get(key):
+      self.send_json(body, etag)
+      return
+
     try:
-      result = self.lib.parse(text, ('rule', *rule))
-      success = True
-    except Exception as e:
-      result = traceback.format_exc()
-      success = False
+      result, success, cacheable = self.service.parse(text, rule)
+    except BrokenProcessPool:
+      # A worker died parsing this text on a fresh pool as well, which has been replaced again
+      self.send_json(dict(result=traceback.format_exc(), success=False), status=503)
+      return
+    except Exception:
+      self.send_json(dict(result=traceback.format_exc(), success=False))
+      return
 
-    self.send_response(200)
-    self.send_header('Content-type', 'application/json')
-    self.end_headers()
-  
-    response = dict(result=result, success=success)
-    self.wfile.write(json.dumps(response, cls=DataClassJSONEncoder).encode('utf-8'))
-
-def run_server():
-  server_address = ('', 8001)
-  httpd = HTTPServer(server_address, lambda *_: LibHandler(Lib(show_parse=True), *_, directory=sys.path[0]))
-  print('serving http://localhost:8001')
-  httpd.serve_forever()
+    body = json.dumps(dict(result=result, success=success), cls=DataClassJSONEncoder).encode('utf-8')
+    if not cacheable:
+      self.send_json(body)
+      return
+    self.service.cache.put(key, body)
+    self.send_json(body, etag)
+
+def run_server(port=8001, workers=None, cache_bytes=64 << 20, timeout=30):
+  service = ParseService(workers, cache_bytes=cache_bytes, timeout=timeout)
+  server_address = ('', port)
+  httpd = ThreadingHTTPServer(server_address, partial(LibHandler, service, directory=sys.path[0]))
+  httpd.daemon_threads = True
+  print(f'serving http://localhost:{port} with {service.workers} parse workers, stats at /stats')
+  try:
+    httpd.serve_forever()
+  finally:
+    service.pool.shutdown(cancel_futures=True)
 
 if __name__ == '__main__':
   run_server()